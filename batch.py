@@ -0,0 +1,314 @@
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+import bitboard
+from bitboard import PAWN, ROOK, BISHOP, KNIGHT, QUEEN, KING
+
+# A batch of N positions is a set of arrays:
+#   squares   (N, 8, 8) int8  Piece.num per square, -1 when empty (Board.square)
+#   colors    (N, 8, 8) int8  1 white, 2 black, 0 empty
+#   side      (N,)      int8  colour to move
+#   castling  (N,)      int8  Board.castlingRights bits, KQkq
+#   enPassant (N,)      int8  square a pawn can take en passant on, -1 for none
+# Legal moves come back as an (N, 64, 64) from/to mask with squares numbered i*8 + j.
+
+ROOK_DIRECTIONS = [(1,0), (-1,0), (0,1), (0,-1)]
+BISHOP_DIRECTIONS = [(1,1), (1,-1), (-1,1), (-1,-1)]
+DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KNIGHT_OFFSETS = [(1,2), (2,1), (2,-1), (1,-2), (-1,-2), (-2,-1), (-2,1), (-1,2)]
+KING_OFFSETS = DIRECTIONS
+
+def _pairs(di, dj):
+    # (source, target) square pairs for one step of (di, dj) that stay on the board
+    src, dst = [], []
+    for sq in range(64):
+        x, y = (sq >> 3) + di, (sq & 7) + dj
+        if 0 <= x < 8 and 0 <= y < 8:
+            src.append(sq)
+            dst.append(x*8 + y)
+    return np.array(src), np.array(dst)
+
+STEP_PAIRS = {(di, dj): _pairs(di, dj) for di in range(-2, 3) for dj in range(-2, 3) if di or dj}
+# RAY_PAIRS[direction][k-1] pairs squares k steps apart
+RAY_PAIRS = {d: [_pairs(d[0]*k, d[1]*k) for k in range(1, 8)] for d in DIRECTIONS}
+ROWS = np.arange(64) >> 3
+
+def boardArrays(board):
+    occupied = board.bitboards.occupied
+    bits = np.arange(64, dtype=np.uint64)
+    colors = ((np.uint64(occupied[1]) >> bits) & np.uint64(1)).astype(np.int8)
+    colors += 2*((np.uint64(occupied[2]) >> bits) & np.uint64(1)).astype(np.int8)
+    enPassant = -1
+    if board.enPassantPawns:
+        enPassant = bitboard.squareIndex(board.enPassantSquare[0], board.enPassantSquare[1])
+    return (board.square.astype(np.int8), colors.reshape(8, 8), (board.moveTurn%2)+1,
+            board.castlingRights, enPassant)
+
+def stackBoards(boards):
+    arrays = [boardArrays(board) for board in boards]
+    return (np.stack([a[0] for a in arrays]), np.stack([a[1] for a in arrays]),
+            np.array([a[2] for a in arrays], dtype=np.int8), np.array([a[3] for a in arrays], dtype=np.int8),
+            np.array([a[4] for a in arrays], dtype=np.int8))
+
+def attackMaps(kind, color, attacker):
+    # (N, 64) squares attacked by colour attacker[n] in each position, built square-major
+    n = len(kind)
+    kind, color = kind.T, color.T
+    mine = color == attacker[None, :]
+    empty = kind == -1
+    attacks = np.zeros((64, n), dtype=bool)
+    for offsets, num in ((KNIGHT_OFFSETS, KNIGHT), (KING_OFFSETS, KING)):
+        pieces = mine & (kind == num)
+        for offset in offsets:
+            src, dst = STEP_PAIRS[offset]
+            attacks[dst] |= pieces[src]
+    pawns = mine & (kind == PAWN)
+    for side, forward in ((1, 1), (2, -1)):
+        side_pawns = pawns & (attacker == side)[None, :]
+        for dj in (-1, 1):
+            src, dst = STEP_PAIRS[(forward, dj)]
+            attacks[dst] |= side_pawns[src]
+    for directions, num in ((ROOK_DIRECTIONS, ROOK), (BISHOP_DIRECTIONS, BISHOP)):
+        sliders = mine & ((kind == num) | (kind == QUEEN))
+        for direction in directions:
+            src, dst = STEP_PAIRS[direction]
+            frontier = sliders
+            for k in range(7):
+                moved = np.zeros((64, n), dtype=bool)
+                moved[dst] = frontier[src]
+                if not moved.any():
+                    break
+                attacks |= moved
+                frontier = moved & empty
+    return attacks.T
+
+def pseudoMoveMasks(kind, color, side, castling, enPassant):
+    # Works square-major, (64, N) planes and a (from*64 + to, N) mask, so each step touches whole rows
+    n = len(kind)
+    kind, color = kind.T, color.T
+    own = color == side[None, :]
+    enemy = (color != 0) & ~own
+    empty = kind == -1
+    targets = ~own
+    masks = np.zeros((64*64, n), dtype=bool)
+
+    for offsets, num in ((KNIGHT_OFFSETS, KNIGHT), (KING_OFFSETS, KING)):
+        pieces = own & (kind == num)
+        for offset in offsets:
+            src, dst = STEP_PAIRS[offset]
+            masks[src*64 + dst] |= pieces[src] & targets[dst]
+
+    for directions, num in ((ROOK_DIRECTIONS, ROOK), (BISHOP_DIRECTIONS, BISHOP)):
+        sliders = own & ((kind == num) | (kind == QUEEN))
+        for direction in directions:
+            alive = sliders
+            for src, dst in RAY_PAIRS[direction]:
+                reach = alive[src]
+                if not reach.any():
+                    break
+                masks[src*64 + dst] |= reach & targets[dst]
+                alive = np.zeros((64, n), dtype=bool)
+                alive[src] = reach & empty[dst]
+
+    ep = np.zeros((64, n), dtype=bool)
+    has_ep = enPassant >= 0
+    ep[enPassant[has_ep], np.flatnonzero(has_ep)] = True
+    for color_to_move, forward, start_row in ((1, 1, 1), (2, -1, 6)):
+        pawns = own & (kind == PAWN) & (side == color_to_move)[None, :]
+        src, dst = STEP_PAIRS[(forward, 0)]
+        masks[src*64 + dst] |= pawns[src] & empty[dst]
+        src2, dst2 = STEP_PAIRS[(2*forward, 0)]
+        on_start = ROWS[src2] == start_row
+        src2, dst2 = src2[on_start], dst2[on_start]
+        masks[src2*64 + dst2] |= pawns[src2] & empty[src2 + 8*forward] & empty[dst2]
+        for dj in (-1, 1):
+            src, dst = STEP_PAIRS[(forward, dj)]
+            masks[src*64 + dst] |= pawns[src] & (enemy[dst] | ep[dst])
+    return np.ascontiguousarray(masks.T).reshape(n, 64, 64)
+
+def legalMoveMasks(squares, colors, side, castling, enPassant):
+    kind = squares.reshape(-1, 64).astype(np.int8)
+    color = colors.reshape(-1, 64).astype(np.int8)
+    side = np.asarray(side, dtype=np.int8)
+    castling = np.asarray(castling, dtype=np.int8)
+    enPassant = np.asarray(enPassant, dtype=np.int16)
+    n = len(kind)
+    rows = np.arange(n)
+    other = (3 - side).astype(np.int8)
+    own = color == side[:, None]
+    masks = pseudoMoveMasks(kind, color, side, castling, enPassant)
+
+    kings = own & (kind == KING)
+    has_king = kings.any(axis=1)
+    king_sq = np.argmax(kings, axis=1)
+    ki, kj = king_sq >> 3, king_sq & 7
+
+    #en passant captures are checked separately below, lift them out of the mask first
+    ep_rows = np.flatnonzero(enPassant >= 0)
+    ep_sq = enPassant[ep_rows]
+    ep_sources = masks[ep_rows, :, ep_sq] & (kind[ep_rows] == PAWN) & own[ep_rows]
+    masks[ep_rows, :, ep_sq] &= ~ep_sources
+
+    #the king may not step along a ray it is blocking itself
+    without_king = kind.copy()
+    without_king[rows[has_king], king_sq[has_king]] = -1
+    attacked = attackMaps(without_king, np.where(without_king == -1, 0, color), other)
+
+    checkers = np.zeros(n, dtype=np.int8)
+    block = np.zeros((n, 64), dtype=bool)
+    for offsets, num in ((KNIGHT_OFFSETS, KNIGHT),):
+        for di, dj in offsets:
+            x, y = ki + di, kj + dj
+            valid = has_king & (x >= 0) & (x < 8) & (y >= 0) & (y < 8)
+            sq = np.where(valid, x*8 + y, 0)
+            hit = valid & (kind[rows, sq] == num) & (color[rows, sq] == other)
+            checkers += hit
+            block[rows[hit], sq[hit]] = True
+    for dj in (-1, 1):
+        #a pawn checks from one row ahead of the king
+        x, y = ki + np.where(side == 1, 1, -1), kj + dj
+        valid = has_king & (x >= 0) & (x < 8) & (y >= 0) & (y < 8)
+        sq = np.where(valid, x*8 + y, 0)
+        hit = valid & (kind[rows, sq] == PAWN) & (color[rows, sq] == other)
+        checkers += hit
+        block[rows[hit], sq[hit]] = True
+
+    for d, (di, dj) in enumerate(DIRECTIONS):
+        slider = ROOK if d < 4 else BISHOP
+        # 0 looking for the first piece, 1 one own piece seen, 2 finished
+        state = np.where(has_king, 0, 2).astype(np.int8)
+        candidate = np.zeros(n, dtype=np.int64)
+        ray = np.zeros((n, 64), dtype=bool)
+        for k in range(1, 8):
+            x, y = ki + k*di, kj + k*dj
+            valid = (x >= 0) & (x < 8) & (y >= 0) & (y < 8)
+            state = np.where(valid, state, 2)
+            active = state < 2
+            if not active.any():
+                break
+            sq = np.where(valid, x*8 + y, 0)
+            ray[rows[active], sq[active]] = True
+            piece = kind[rows, sq]
+            occupied = active & (piece != -1)
+            mine = occupied & (color[rows, sq] == side)
+            attacker = occupied & (color[rows, sq] == other) & ((piece == slider) | (piece == QUEEN))
+
+            check = (state == 0) & attacker
+            checkers += check
+            block[check] |= ray[check]
+            pin = (state == 1) & attacker
+            pinned = np.flatnonzero(pin)
+            masks[pinned, candidate[pinned], :] &= ray[pinned]
+
+            first_own = (state == 0) & mine
+            candidate = np.where(first_own, sq, candidate)
+            state = np.where(first_own, 1, np.where(occupied, 2, state)).astype(np.int8)
+
+    #outside check any target is fine, in double check only the king moves
+    block[checkers == 0] = True
+    block[checkers > 1] = False
+    king_rows = rows[has_king]
+    king_moves = masks[king_rows, king_sq[has_king], :] & ~attacked[has_king]
+    masks &= block[:, None, :]
+    masks[king_rows, king_sq[has_king], :] = king_moves
+
+    # castling: (rights bit, side, king destination, squares that must be empty, squares the king crosses)
+    empty = kind == -1
+    safe = (checkers == 0) & has_king
+    for bit, color_to_move, row, to_j, empty_js, path_js in ((0, 1, 0, 1, (1, 2), (2, 1)), (1, 1, 0, 5, (4, 5, 6), (4, 5)),
+                                                            (2, 2, 7, 1, (1, 2), (2, 1)), (3, 2, 7, 5, (4, 5, 6), (4, 5))):
+        allowed = safe & (side == color_to_move) & ((castling >> bit) & 1 == 1)
+        allowed &= (kind[:, row*8 + 3] == KING) & (kind[:, row*8 + (0 if to_j == 1 else 7)] == ROOK)
+        for j in empty_js:
+            allowed &= empty[:, row*8 + j]
+        for j in path_js:
+            allowed &= ~attacked[:, row*8 + j]
+        masks[allowed, row*8 + 3, row*8 + to_j] = True
+
+    #en passant: replay each capture on a copy of the position and look at the king
+    cand_rows, cand_src = np.nonzero(ep_sources)
+    if len(cand_rows):
+        board_rows = ep_rows[cand_rows]
+        target = ep_sq[cand_rows].astype(np.int64)
+        captured = target + np.where(side[board_rows] == 1, -8, 8)
+        after = kind[board_rows].copy()
+        after_color = color[board_rows].copy()
+        local = np.arange(len(board_rows))
+        after[local, target] = PAWN
+        after_color[local, target] = side[board_rows]
+        for sq in (cand_src, captured):
+            after[local, sq] = -1
+            after_color[local, sq] = 0
+        exposed = attackMaps(after, after_color, other[board_rows])[local, king_sq[board_rows]]
+        ok = ~exposed | ~has_king[board_rows]
+        masks[board_rows[ok], cand_src[ok], target[ok]] = True
+    return masks
+
+def moveLists(masks, squares, side):
+    # encoded moves per position (bitboard.encodeMove), pawn moves onto the last row expanded to each promotion
+    kind = squares.reshape(-1, 64)
+    n = len(kind)
+    rows, src, dst = np.nonzero(masks)
+    last_row = np.where(side[rows] == 1, 7, 0)
+    promoting = (kind[rows, src] == PAWN) & (ROWS[dst] == last_row)
+    encoded = src | (dst << 6)
+    promotions = np.array(bitboard.PROMOTIONS)
+    expanded = (encoded[promoting][:, None] | (promotions << 12)[None, :]).ravel()
+    all_rows = np.concatenate([rows[~promoting], np.repeat(rows[promoting], len(promotions))])
+    all_moves = np.concatenate([encoded[~promoting], expanded])
+    order = np.argsort(all_rows, kind='stable')
+    counts = np.bincount(all_rows, minlength=n)
+    return np.split(all_moves[order], np.cumsum(counts)[:-1])
+
+def legalMoveLists(squares, colors, side, castling, enPassant):
+    side = np.asarray(side, dtype=np.int8)
+    return moveLists(legalMoveMasks(squares, colors, side, castling, enPassant), squares, side)
+
+def randomBoards(count, plies, seed = 0):
+    from chess import Board
+    rng = random.Random(seed)
+    boards = []
+    for _ in range(count):
+        board = Board(8, 8, backend='bitboard')
+        for _ in range(rng.randint(0, plies)):
+            moves = bitboard.legalMoves(board, (board.moveTurn%2)+1)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        boards.append(board)
+    return boards
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Compare batched and per-board legal move generation.')
+    parser.add_argument('--positions', type=int, default=2000)
+    parser.add_argument('--plies', type=int, default=60, help='random plies played from the start per position')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 1000])
+    args = parser.parse_args(argv)
+
+    boards = randomBoards(args.positions, args.plies)
+    start = time.perf_counter()
+    for board in boards:
+        bitboard.legalMoves(board, (board.moveTurn%2)+1)
+    serial = time.perf_counter() - start
+    print('per board   %10.0f positions/sec' % (len(boards) / serial))
+
+    arrays = stackBoards(boards)
+    for size in args.sizes:
+        chunks = [[array[first:first + size] for array in arrays] for first in range(0, len(boards), size)]
+        start = time.perf_counter()
+        for chunk in chunks:
+            legalMoveMasks(*chunk)
+        masks = time.perf_counter() - start
+        start = time.perf_counter()
+        for chunk in chunks:
+            legalMoveLists(*chunk)
+        lists = time.perf_counter() - start
+        print('batch %5d %10.0f positions/sec as masks, %10.0f as move lists' % (size, len(boards) / masks, len(boards) / lists))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,524 @@
+import numpy as np
+
+# Squares are numbered i*8 + j, matching Board.state[i, j]. Piece kinds use Piece.num:
+PAWN, ROOK, BISHOP, KNIGHT, QUEEN, KING = 1, 2, 3, 4, 5, 6
+
+FULL = (1 << 64) - 1
+
+#file letters by column, the king starts on column 3 (e-file)
+FILES = 'hgfedcba'
+PROMOTIONS = (QUEEN, ROOK, BISHOP, KNIGHT)
+PROMOTION_LETTERS = {QUEEN: 'q', ROOK: 'r', BISHOP: 'b', KNIGHT: 'n'}
+
+def squareIndex(i, j):
+    return i*8 + j
+
+def squareLocation(sq):
+    return [sq >> 3, sq & 7]
+
+# Moves are packed into one int: from | to << 6 | promotion << 12 (promotion is a Piece.num)
+def encodeMove(start, end, promotion = 0):
+    return start | (end << 6) | (promotion << 12)
+
+def moveFrom(move):
+    return move & 63
+
+def moveTo(move):
+    return (move >> 6) & 63
+
+def movePromotion(move):
+    return move >> 12
+
+def squareName(sq):
+    return FILES[sq & 7] + str((sq >> 3) + 1)
+
+def moveName(move):
+    # coordinate notation, e.g. e2e4 or e7e8q
+    name = squareName(moveFrom(move)) + squareName(moveTo(move))
+    if movePromotion(move):
+        name += PROMOTION_LETTERS[movePromotion(move)]
+    return name
+
+def iterBits(bb):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+def popCount(bb):
+    return bb.bit_count()
+
+def _leaperTable(offsets):
+    table = []
+    for sq in range(64):
+        i, j = sq >> 3, sq & 7
+        mask = 0
+        for di, dj in offsets:
+            x, y = i + di, j + dj
+            if 0 <= x < 8 and 0 <= y < 8:
+                mask |= 1 << squareIndex(x, y)
+        table.append(mask)
+    return table
+
+def _rayTable(di, dj):
+    table = []
+    for sq in range(64):
+        x, y = (sq >> 3) + di, (sq & 7) + dj
+        mask = 0
+        while 0 <= x < 8 and 0 <= y < 8:
+            mask |= 1 << squareIndex(x, y)
+            x, y = x + di, y + dj
+        table.append(mask)
+    return table
+
+KNIGHT_ATTACKS = _leaperTable([(1,2), (2,1), (2,-1), (1,-2), (-1,-2), (-2,-1), (-2,1), (-1,2)])
+KING_ATTACKS = _leaperTable([(1,0), (1,1), (0,1), (-1,1), (-1,0), (-1,-1), (0,-1), (1,-1)])
+#white pawns move down the array (i+1), black pawns up (i-1)
+PAWN_ATTACKS = {1: _leaperTable([(1,1), (1,-1)]), 2: _leaperTable([(-1,1), (-1,-1)])}
+
+RAYS = {(di, dj): _rayTable(di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1) if di or dj}
+# (ray table, True if the ray runs towards higher square numbers)
+ROOK_RAYS = [(RAYS[d], d[0]*8 + d[1] > 0) for d in [(1,0), (-1,0), (0,1), (0,-1)]]
+BISHOP_RAYS = [(RAYS[d], d[0]*8 + d[1] > 0) for d in [(1,1), (1,-1), (-1,1), (-1,-1)]]
+
+def _betweenTable():
+    # squares strictly between two squares on a shared rank, file or diagonal
+    table = [[0]*64 for _ in range(64)]
+    for sq in range(64):
+        for (di, dj) in RAYS:
+            x, y = (sq >> 3) + di, (sq & 7) + dj
+            mask = 0
+            while 0 <= x < 8 and 0 <= y < 8:
+                table[sq][squareIndex(x, y)] = mask
+                mask |= 1 << squareIndex(x, y)
+                x, y = x + di, y + dj
+    return table
+
+BETWEEN = _betweenTable()
+#a1 and every square of its colour (files run from h, so i + j is odd)
+DARK_SQUARES = sum(1 << sq for sq in range(64) if ((sq >> 3) + (sq & 7)) % 2 == 1)
+ROOK_LINES = [RAYS[(1,0)][sq] | RAYS[(-1,0)][sq] | RAYS[(0,1)][sq] | RAYS[(0,-1)][sq] for sq in range(64)]
+BISHOP_LINES = [RAYS[(1,1)][sq] | RAYS[(1,-1)][sq] | RAYS[(-1,1)][sq] | RAYS[(-1,-1)][sq] for sq in range(64)]
+
+def slidingAttacks(sq, occupied, rays):
+    attacks = 0
+    for table, positive in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if positive:
+                ray ^= table[(blockers & -blockers).bit_length() - 1]
+            else:
+                ray ^= table[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+def rookAttacks(sq, occupied):
+    return slidingAttacks(sq, occupied, ROOK_RAYS)
+
+def bishopAttacks(sq, occupied):
+    return slidingAttacks(sq, occupied, BISHOP_RAYS)
+
+def queenAttacks(sq, occupied):
+    return slidingAttacks(sq, occupied, ROOK_RAYS) | slidingAttacks(sq, occupied, BISHOP_RAYS)
+
+def pieceAttacks(num, color, sq, occupied):
+    if num == PAWN:
+        return PAWN_ATTACKS[color][sq]
+    if num == KNIGHT:
+        return KNIGHT_ATTACKS[sq]
+    if num == KING:
+        return KING_ATTACKS[sq]
+    if num == ROOK:
+        return rookAttacks(sq, occupied)
+    if num == BISHOP:
+        return bishopAttacks(sq, occupied)
+    return queenAttacks(sq, occupied)
+
+class Bitboards:
+    def __init__(self):
+        # pieces[color][num], colors 1 and 2 as on Board
+        self.pieces = [[0]*7 for _ in range(3)]
+        self.occupied = [0, 0, 0]
+
+    def add(self, color, num, sq):
+        b = 1 << sq
+        self.pieces[color][num] |= b
+        self.occupied[color] |= b
+        self.occupied[0] |= b
+
+    def remove(self, color, num, sq):
+        b = ~(1 << sq)
+        self.pieces[color][num] &= b
+        self.occupied[color] &= b
+        self.occupied[0] &= b
+
+def fromBoard(board):
+    bb = Bitboards()
+    square = board.square
+    state = board.state
+    for sq in np.flatnonzero(square.ravel() != -1).tolist():
+        i, j = sq >> 3, sq & 7
+        bb.add(state[i,j].color, square[i,j], sq)
+    return bb
+
+def isSquareAttacked(bb, sq, by_color, occupied, mask = FULL):
+    pieces = bb.pieces[by_color]
+    if KNIGHT_ATTACKS[sq] & pieces[KNIGHT] & mask:
+        return True
+    if PAWN_ATTACKS[(by_color%2)+1][sq] & pieces[PAWN] & mask:
+        return True
+    if KING_ATTACKS[sq] & pieces[KING] & mask:
+        return True
+    sliders = (pieces[ROOK] | pieces[QUEEN]) & mask
+    if sliders and rookAttacks(sq, occupied) & sliders:
+        return True
+    sliders = (pieces[BISHOP] | pieces[QUEEN]) & mask
+    if sliders and bishopAttacks(sq, occupied) & sliders:
+        return True
+    return False
+
+def attackersTo(bb, sq, occupied):
+    # pieces of both colours attacking sq through the given occupancy, lifting pieces out of
+    # occupied uncovers the sliders behind them
+    white, black = bb.pieces[1], bb.pieces[2]
+    rooks = white[ROOK] | white[QUEEN] | black[ROOK] | black[QUEEN]
+    bishops = white[BISHOP] | white[QUEEN] | black[BISHOP] | black[QUEEN]
+    return ((PAWN_ATTACKS[2][sq] & white[PAWN]) | (PAWN_ATTACKS[1][sq] & black[PAWN])
+            | (KNIGHT_ATTACKS[sq] & (white[KNIGHT] | black[KNIGHT])) | (KING_ATTACKS[sq] & (white[KING] | black[KING]))
+            | (rookAttacks(sq, occupied) & rooks) | (bishopAttacks(sq, occupied) & bishops)) & occupied
+
+def attackedSquares(bb, color, occupied):
+    attacks = 0
+    for num in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+        for sq in iterBits(bb.pieces[color][num]):
+            attacks |= pieceAttacks(num, color, sq, occupied)
+    return attacks
+
+class AttackMap:
+    # Attack counts per colour kept up to date as pieces are added and removed. attacks[sq] is the
+    # attack set of the piece on sq, counts[color][sq] how many pieces of that colour hit sq and
+    # attacked[color] the squares where that count is not zero. Only the moved piece and the sliders
+    # whose rays pass through the changed square are recomputed.
+    def __init__(self, bb):
+        self.kinds = [None]*64
+        self.attacks = [0]*64
+        self.counts = [None, [0]*64, [0]*64]
+        self.attacked = [0, 0, 0]
+        occupied = bb.occupied[0]
+        for color in (1, 2):
+            for num in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+                for sq in iterBits(bb.pieces[color][num]):
+                    self.kinds[sq] = (color, num)
+                    self.attacks[sq] = pieceAttacks(num, color, sq, occupied)
+                    self.count(color, self.attacks[sq], 1)
+
+    def count(self, color, squares, step):
+        counts = self.counts[color]
+        edge = 1 if step > 0 else 0
+        for sq in iterBits(squares):
+            counts[sq] += step
+            if counts[sq] == edge:
+                self.attacked[color] ^= 1 << sq
+
+    def updateSliders(self, bb, sq):
+        # rays are symmetric, so the sliders that see sq are the ones a slider on sq would hit
+        occupied = bb.occupied[0]
+        pieces = bb.pieces
+        rooks = pieces[1][ROOK] | pieces[1][QUEEN] | pieces[2][ROOK] | pieces[2][QUEEN]
+        bishops = pieces[1][BISHOP] | pieces[1][QUEEN] | pieces[2][BISHOP] | pieces[2][QUEEN]
+        sliders = (rookAttacks(sq, occupied) & rooks) | (bishopAttacks(sq, occupied) & bishops)
+        for slider in iterBits(sliders):
+            color, num = self.kinds[slider]
+            old, new = self.attacks[slider], pieceAttacks(num, color, slider, occupied)
+            if old != new:
+                self.count(color, old & ~new, -1)
+                self.count(color, new & ~old, 1)
+                self.attacks[slider] = new
+
+    def add(self, bb, color, num, sq):
+        # call after bb.add
+        self.updateSliders(bb, sq)
+        self.kinds[sq] = (color, num)
+        self.attacks[sq] = pieceAttacks(num, color, sq, bb.occupied[0])
+        self.count(color, self.attacks[sq], 1)
+
+    def remove(self, bb, sq):
+        # call after bb.remove
+        color, num = self.kinds[sq]
+        self.count(color, self.attacks[sq], -1)
+        self.kinds[sq] = None
+        self.attacks[sq] = 0
+        self.updateSliders(bb, sq)
+
+    def isAttacked(self, sq, by_color):
+        return (self.attacked[by_color] >> sq) & 1 == 1
+
+    def attackerCount(self, sq, color):
+        # pieces of color hitting sq, its defenders when the piece on sq is also color
+        return self.counts[color][sq]
+
+class KingSafety:
+    # Attack, check and pin analysis for one side, computed once per position.
+    # With an up to date AttackMap the enemy attacks are read from it instead of regenerated.
+    def __init__(self, bb, color, attackMap = None):
+        enemy = (color%2)+1
+        pieces = bb.pieces[enemy]
+        occupied = bb.occupied[0]
+        self.color = color
+        self.kingSquare = -1
+        self.attacked = 0
+        self.checkers = 0
+        self.blockMask = FULL
+        self.pinned = {}
+        if not bb.pieces[color][KING]:
+            return
+        king = self.kingSquare = bb.pieces[color][KING].bit_length() - 1
+        rooks = pieces[ROOK] | pieces[QUEEN]
+        bishops = pieces[BISHOP] | pieces[QUEEN]
+        self.checkers = ((KNIGHT_ATTACKS[king] & pieces[KNIGHT]) | (PAWN_ATTACKS[color][king] & pieces[PAWN])
+                         | (rookAttacks(king, occupied) & rooks) | (bishopAttacks(king, occupied) & bishops))
+        #the king must not hide behind itself from a slider
+        if attackMap is None:
+            self.attacked = attackedSquares(bb, enemy, occupied & ~(1 << king))
+        else:
+            self.attacked = attackMap.attacked[enemy]
+            for sq in iterBits(self.checkers & (rooks | bishops)):
+                self.attacked |= pieceAttacks(attackMap.kinds[sq][1], enemy, sq, occupied & ~(1 << king))
+        if self.checkers:
+            if self.checkers & (self.checkers - 1):
+                self.blockMask = 0
+            else:
+                self.blockMask = self.checkers | BETWEEN[king][self.checkers.bit_length() - 1]
+        
+        own = bb.occupied[color]
+        snipers = (ROOK_LINES[king] & rooks) | (BISHOP_LINES[king] & bishops)
+        for sq in iterBits(snipers):
+            between = BETWEEN[king][sq] & occupied
+            if between and not between & (between - 1) and between & own:
+                self.pinned[between.bit_length() - 1] = BETWEEN[king][sq] | (1 << sq)
+
+    def allows(self, move):
+        start, end = moveFrom(move), moveTo(move)
+        if start == self.kingSquare:
+            if (self.attacked >> end) & 1:
+                return False
+            if abs((end & 7) - (start & 7)) == 2:
+                #castling: not out of, or through, check
+                return not self.checkers and not (self.attacked >> ((start + end) >> 1)) & 1
+            return True
+        if not (self.blockMask >> end) & 1:
+            return False
+        pin = self.pinned.get(start)
+        return pin is None or (pin >> end) & 1 == 1
+
+def pseudoMoves(board, bb, color):
+    own = bb.occupied[color]
+    enemy = bb.occupied[(color%2)+1]
+    occupied = bb.occupied[0]
+    pieces = bb.pieces[color]
+    moves = []
+
+    #Pawns
+    forward = 8 if color == 1 else -8
+    start_row = 1 if color == 1 else 6
+    end_row = 7 if color == 1 else 0
+    for sq in iterBits(pieces[PAWN]):
+        targets = PAWN_ATTACKS[color][sq] & enemy
+        one = sq + forward
+        if not (occupied >> one) & 1:
+            targets |= 1 << one
+            if (sq >> 3) == start_row and not (occupied >> (one + forward)) & 1:
+                targets |= 1 << (one + forward)
+        for to in iterBits(targets):
+            if (to >> 3) == end_row:
+                for promotion in PROMOTIONS:
+                    moves.append(encodeMove(sq, to, promotion))
+            else:
+                moves.append(encodeMove(sq, to))
+    if board.enPassantSquare is not None and (board.moveTurn%2)+1 == color:
+        ep = squareIndex(board.enPassantSquare[0], board.enPassantSquare[1])
+        if (bb.pieces[(color%2)+1][PAWN] >> (ep - forward)) & 1:
+            for sq in iterBits(PAWN_ATTACKS[(color%2)+1][ep] & pieces[PAWN]):
+                moves.append(encodeMove(sq, ep))
+
+    for sq in iterBits(pieces[KNIGHT]):
+        for to in iterBits(KNIGHT_ATTACKS[sq] & ~own):
+            moves.append(encodeMove(sq, to))
+    for sq in iterBits(pieces[BISHOP]):
+        for to in iterBits(bishopAttacks(sq, occupied) & ~own):
+            moves.append(encodeMove(sq, to))
+    for sq in iterBits(pieces[ROOK]):
+        for to in iterBits(rookAttacks(sq, occupied) & ~own):
+            moves.append(encodeMove(sq, to))
+    for sq in iterBits(pieces[QUEEN]):
+        for to in iterBits(queenAttacks(sq, occupied) & ~own):
+            moves.append(encodeMove(sq, to))
+    for sq in iterBits(pieces[KING]):
+        for to in iterBits(KING_ATTACKS[sq] & ~own):
+            moves.append(encodeMove(sq, to))
+        moves.extend(castleMoves(board, bb, color, sq))
+    return moves
+
+def captureMoves(board, bb, color, origins = FULL):
+    # captures, en passant and every promotion, from the squares in origins
+    enemy = bb.occupied[(color%2)+1]
+    occupied = bb.occupied[0]
+    pieces = bb.pieces[color]
+    moves = []
+
+    forward = 8 if color == 1 else -8
+    end_row = 7 if color == 1 else 0
+    for sq in iterBits(pieces[PAWN] & origins):
+        targets = PAWN_ATTACKS[color][sq] & enemy
+        one = sq + forward
+        if (one >> 3) == end_row and not (occupied >> one) & 1:
+            targets |= 1 << one
+        for to in iterBits(targets):
+            if (to >> 3) == end_row:
+                for promotion in PROMOTIONS:
+                    moves.append(encodeMove(sq, to, promotion))
+            else:
+                moves.append(encodeMove(sq, to))
+    if board.enPassantSquare is not None and (board.moveTurn%2)+1 == color:
+        ep = squareIndex(board.enPassantSquare[0], board.enPassantSquare[1])
+        if (bb.pieces[(color%2)+1][PAWN] >> (ep - forward)) & 1:
+            for sq in iterBits(PAWN_ATTACKS[(color%2)+1][ep] & pieces[PAWN] & origins):
+                moves.append(encodeMove(sq, ep))
+
+    for num in (KNIGHT, BISHOP, ROOK, QUEEN, KING):
+        for sq in iterBits(pieces[num] & origins):
+            for to in iterBits(pieceAttacks(num, color, sq, occupied) & enemy):
+                moves.append(encodeMove(sq, to))
+    return moves
+
+def quietMoves(board, bb, color, origins = FULL):
+    # non-capturing moves other than promotions, castling included, from the squares in origins
+    occupied = bb.occupied[0]
+    pieces = bb.pieces[color]
+    moves = []
+
+    forward = 8 if color == 1 else -8
+    start_row = 1 if color == 1 else 6
+    end_row = 7 if color == 1 else 0
+    for sq in iterBits(pieces[PAWN] & origins):
+        one = sq + forward
+        if (one >> 3) != end_row and not (occupied >> one) & 1:
+            moves.append(encodeMove(sq, one))
+            if (sq >> 3) == start_row and not (occupied >> (one + forward)) & 1:
+                moves.append(encodeMove(sq, one + forward))
+
+    for num in (KNIGHT, BISHOP, ROOK, QUEEN, KING):
+        for sq in iterBits(pieces[num] & origins):
+            for to in iterBits(pieceAttacks(num, color, sq, occupied) & ~occupied):
+                moves.append(encodeMove(sq, to))
+    for sq in iterBits(pieces[KING] & origins):
+        moves.extend(castleMoves(board, bb, color, sq))
+    return moves
+
+def isPseudoLegal(board, bb, move, color):
+    # whether move could be generated here, for moves that come from elsewhere (hash moves, killers)
+    origin = 1 << moveFrom(move)
+    if not bb.occupied[color] & origin:
+        return False
+    return move in captureMoves(board, bb, color, origin) or move in quietMoves(board, bb, color, origin)
+
+def castleMoves(board, bb, color, king_sq):
+    row = 0 if color == 1 else 7
+    if king_sq != squareIndex(row, 3) or board.state[row, 3].hasMoved:
+        return []
+    occupied = bb.occupied[0]
+    moves = []
+    # rook column, squares that must be empty, king destination. Attacked squares are left to KingSafety
+    for rook_j, empty, to_j in [(0, (1, 2), 1), (7, (4, 5, 6), 5)]:
+        rook = board.state[row, rook_j]
+        if board.square[row, rook_j] != ROOK or rook.color != color or rook.hasMoved:
+            continue
+        if any((occupied >> squareIndex(row, j)) & 1 for j in empty):
+            continue
+        moves.append(encodeMove(king_sq, squareIndex(row, to_j)))
+    return moves
+
+def isEnPassant(bb, move, color):
+    start, end = moveFrom(move), moveTo(move)
+    return ((bb.pieces[color][PAWN] >> start) & 1 and (start - end) % 8 != 0
+            and not (bb.occupied[0] >> end) & 1)
+
+def isLegal(bb, move, color):
+    start, end = moveFrom(move), moveTo(move)
+    enemy = (color%2)+1
+    start_bit, end_bit = 1 << start, 1 << end
+    occupied = (bb.occupied[0] & ~start_bit) | end_bit
+    mask = ~end_bit
+    if isEnPassant(bb, move, color):
+        captured = end - 8 if color == 1 else end + 8
+        occupied &= ~(1 << captured)
+        mask &= ~(1 << captured)
+    if (bb.pieces[color][KING] >> start) & 1:
+        king_sq = end
+    elif bb.pieces[color][KING]:
+        king_sq = bb.pieces[color][KING].bit_length() - 1
+    else:
+        return True
+    return not isSquareAttacked(bb, king_sq, enemy, occupied, mask)
+
+def isLegalMove(bb, safety, move, color):
+    if isEnPassant(bb, move, color):
+        #en passant removes two pieces from a rank, check it directly
+        return isLegal(bb, move, color)
+    return safety.allows(move)
+
+def legalMoves(board, color, bb = None):
+    if bb is None:
+        bb = board.bitboards
+    safety = KingSafety(bb, color, board.attackMap if bb is board.bitboards else None)
+    return [move for move in pseudoMoves(board, bb, color) if isLegalMove(bb, safety, move, color)]
+
+def hasLegalMove(board, color, bb = None):
+    # Stops at the first legal move found. The king goes first, then the other pieces by distance
+    # from it, the ones most likely to block or take a checker
+    if bb is None:
+        bb = board.bitboards
+    safety = KingSafety(bb, color, board.attackMap if bb is board.bitboards else None)
+    own = bb.occupied[color]
+    if safety.kingSquare >= 0:
+        if KING_ATTACKS[safety.kingSquare] & ~own & ~safety.attacked:
+            return True
+        if not safety.blockMask:
+            #double check, only the king could have moved
+            return False
+    king_i, king_j = safety.kingSquare >> 3, safety.kingSquare & 7
+    squares = sorted(iterBits(own & ~bb.pieces[color][KING]),
+                     key=lambda sq: max(abs((sq >> 3) - king_i), abs((sq & 7) - king_j)))
+    for sq in squares:
+        origin = 1 << sq
+        for move in captureMoves(board, bb, color, origin) + quietMoves(board, bb, color, origin):
+            if isLegalMove(bb, safety, move, color):
+                return True
+    return False
+
+def insufficientMaterial(bb):
+    # neither side can mate: bare kings, a single minor piece, or bishops all on one square colour
+    for color in (1, 2):
+        pieces = bb.pieces[color]
+        if pieces[PAWN] or pieces[ROOK] or pieces[QUEEN]:
+            return False
+    knights = bb.pieces[1][KNIGHT] | bb.pieces[2][KNIGHT]
+    bishops = bb.pieces[1][BISHOP] | bb.pieces[2][BISHOP]
+    if not bishops:
+        return popCount(knights) <= 1
+    return not knights and (not bishops & DARK_SQUARES or not bishops & ~DARK_SQUARES)
+
+def getAllMoves(board, color):
+    bb = board.bitboards
+    curr_pieceMap = {}
+    for sq in iterBits(bb.occupied[color]):
+        curr_pieceMap[board.state[sq >> 3, sq & 7].name] = []
+    for move in legalMoves(board, color, bb):
+        if movePromotion(move) not in (0, QUEEN):
+            continue
+        start, end = moveFrom(move), moveTo(move)
+        curr_pieceMap[board.state[start >> 3, start & 7].name].append([end >> 3, end & 7])
+    for name, targets in curr_pieceMap.items():
+        curr_pieceMap[name] = np.array(targets, dtype=int).reshape(-1, 2)
+    return curr_pieceMap
@@ -0,0 +1,114 @@
+import argparse
+import sys
+
+import numpy as np
+
+import pgn
+import selfplay
+from chess import Board, fenSetup, START_FEN
+
+# Book records sorted by key: zobrist key of the position, move played (bitboard.encodeMove), weight
+BOOK_DTYPE = np.dtype([('key', '<u8'), ('move', '<u2'), ('weight', '<u2')])
+MAX_WEIGHT = (1 << 16) - 1
+
+class Book:
+    # Memory mapped book file, nothing is read at open. A probe is a binary search touching
+    # O(log n) records.
+    def __init__(self, path):
+        self.path = path
+        self.records = np.memmap(path, dtype=BOOK_DTYPE, mode='r')
+
+    def __len__(self):
+        return len(self.records)
+
+    def lookup(self, key):
+        # (move, weight) pairs stored for key
+        records = self.records
+        low, high = 0, len(records)
+        while low < high:
+            middle = (low + high) >> 1
+            if int(records[middle]['key']) < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        while low < len(records) and int(records[low]['key']) == key:
+            found.append((int(records[low]['move']), int(records[low]['weight'])))
+            low += 1
+        return found
+
+    def choose(self, board, rng = None):
+        # a legal book move for board, weighted at random with rng or the heaviest without, None when out of book
+        moves = board.bookMoves(self)
+        if not moves:
+            return None
+        if rng is None:
+            return max(moves, key=lambda entry: entry[1])[0]
+        return rng.choices([move for move, _ in moves], [weight for _, weight in moves])[0]
+
+def countMoves(games, plies):
+    # {(key, move): count} over the first plies of each game, games being (board, moves) pairs
+    counts = {}
+    for board, moves in games:
+        for move in moves[:plies]:
+            counts[board.zobristKey, move] = counts.get((board.zobristKey, move), 0) + 1
+            board.push(move)
+    return counts
+
+def pgnGames(paths):
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as lines:
+            for headers, sans, result in pgn.readGames(lines):
+                board = pgn.startBoard(headers)
+                moves = []
+                try:
+                    for _, move in pgn.replayGame(headers, sans):
+                        moves.append(move)
+                except pgn.PGNError:
+                    pass
+                yield board, moves
+
+def selfplayGames(directories):
+    # games are stored ply after ply from the start position, a record with ply 0 starts the next one
+    for directory in directories:
+        for shard in selfplay.loadShards(directory):
+            starts = np.flatnonzero(shard['position']['ply'] == 0).tolist() + [len(shard)]
+            for first, last in zip(starts, starts[1:]):
+                yield Board(8, 8, backend='bitboard'), shard['move'][first:last].tolist()
+
+def buildBook(path, counts, minCount = 1):
+    entries = [(key, move, min(count, MAX_WEIGHT)) for (key, move), count in counts.items() if count >= minCount]
+    records = np.array(entries, dtype=BOOK_DTYPE)
+    records = records[np.argsort(records['key'], kind='stable')]
+    records.tofile(path)
+    return len(records)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Build or probe an opening book.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='count the opening moves of PGN files and self-play shards')
+    build.add_argument('path')
+    build.add_argument('--pgn', nargs='*', default=[])
+    build.add_argument('--selfplay', nargs='*', default=[], help='self-play shard directories')
+    build.add_argument('--plies', type=int, default=16, help='opening plies taken from each game')
+    build.add_argument('--min-count', type=int, default=1, help='drop moves seen fewer times')
+    probe = commands.add_parser('probe', help='list the book moves for a position')
+    probe.add_argument('path')
+    probe.add_argument('--fen', default=START_FEN)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        counts = countMoves(pgnGames(args.pgn), args.plies)
+        for key, count in countMoves(selfplayGames(args.selfplay), args.plies).items():
+            counts[key] = counts.get(key, 0) + count
+        print('%d records written to %s' % (buildBook(args.path, counts, args.min_count), args.path))
+        return 0
+
+    book = Book(args.path)
+    board = Board(8, 8, fenSetup(args.fen), backend='bitboard')
+    for move, weight in sorted(board.bookMoves(book), key=lambda entry: -entry[1]):
+        print('%s %d' % (pgn.moveToSan(board, move), weight))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
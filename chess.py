@@ -1,14 +1,19 @@
 import numpy as np
-import statistics as st
+import bitboard
+import evaluation
+import zobrist
 
 class Piece:
+    # colour, kind (num) and square (i*8 + j) are plain ints; name stays the string key of the
+    # whitePieces/blackPieces and move map dicts the GUI and makeMove look pieces up by
+    __slots__ = ('name', 'color', 'moves', 'attacks', 'num', 'hasMoved', 'square')
+    
     def __init__(self, name, color, moves, attacks, num):
         self.name = name
         self.color = color
         self.moves = moves
         self.attacks = attacks
         self.num = num
-        self.isDefended = False
         self.hasMoved = False
     
     def __eq__(self, other):
@@ -17,40 +22,69 @@ class Piece:
             return NotImplemented
         return self.color == other.color
 
-def resetDefended(state):
-    if isinstance(state, Piece):
-        state.isDefended = False
+    @property
+    def location(self):
+        # [i, j] view of square for the array code and the GUI
+        return [self.square >> 3, self.square & 7]
+
+    @location.setter
+    def location(self, location):
+        self.square = int(location[0])*8 + int(location[1])
 
-resetDefended = np.frompyfunc(resetDefended, 1, 0)  
+# Move templates are shared between every piece of a type and colour, built once on first use
+TEMPLATES = {}
+
+def sharedTemplate(pieceType, color):
+    key = (pieceType, color)
+    if key not in TEMPLATES:
+        templates = pieceType.buildTemplates(color)
+        for template in templates:
+            template.flags.writeable = False
+        TEMPLATES[key] = templates
+    return TEMPLATES[key]
     
 class Pawn(Piece):
+    __slots__ = ('enPassant', 'first_move')
+    
     def __init__(self, name, color, location):
         self.location = location
         self.enPassant = False
+        moves, attacks, self.first_move = sharedTemplate(Pawn, color)
+        super().__init__(name if name else 'Pawn', color, moves, attacks, 1)
+    
+    @staticmethod
+    def buildTemplates(color):
         #centered at 7,7
-        self.first_move = np.zeros((15,15))
+        first_move = np.zeros((15,15))
         moves = np.zeros((15,15)) #[[0 for j in range(15)] for i in range(15)]
         attacks = np.zeros((15,15)) #[[0 for j in range(15)] for i in range(15)]
         if color == 1:
-            self.first_move[8][7] = 1
-            self.first_move[9][7] = 1
+            first_move[8][7] = 1
+            first_move[9][7] = 1
             moves[8][7] = 1
             attacks[8][6] = 1
             attacks[8][8] = 1
         if color == 2:
-            self.first_move[6][7] = 1
-            self.first_move[5][7] = 1
+            first_move[6][7] = 1
+            first_move[5][7] = 1
             moves[6][7] = 1
             attacks[6][6] = 1
             attacks[6][8] = 1
         
         moves[7][7] = -1
         attacks[7][7] = -1
-        super().__init__(name if name else 'Pawn', color, moves, attacks, 1)
+        return moves, attacks, first_move
     
 class Rook(Piece):
+    __slots__ = ()
+    
     def __init__(self, name, color, location):
         self.location = location
+        moves, attacks = sharedTemplate(Rook, color)
+        super().__init__(name if name else 'Rook', color, moves, attacks, 2)
+    
+    @staticmethod
+    def buildTemplates(color):
         #centered at 7,7
         moves = np.zeros((15,15)) #[[0 for j in range(15)] for i in range(15)]
         attacks = np.zeros((15,15)) #[[0 for j in range(15)] for i in range(15)]
@@ -62,12 +96,18 @@ class Rook(Piece):
 
         moves[7][7] = -1
         attacks[7][7] = -1
-        
-        super().__init__(name if name else 'Rook', color, moves, attacks, 2)
+        return moves, attacks
 
 class Bishop(Piece):
+    __slots__ = ()
+    
     def __init__(self, name, color, location):
         self.location = location
+        moves, attacks = sharedTemplate(Bishop, color)
+        super().__init__(name if name else 'Bishop', color, moves, attacks, 3)
+    
+    @staticmethod
+    def buildTemplates(color):
         #centered at 7,7
         moves = np.zeros((15,15)) #[[0 for j in range(15)] for i in range(15)]
         attacks = np.zeros((15,15)) #[[0 for j in range(15)] for i in range(15)]
@@ -79,12 +119,18 @@ class Bishop(Piece):
 
         moves[7][7] = -1
         attacks[7][7] = -1
-        
-        super().__init__(name if name else 'Bishop', color, moves, attacks, 3)
+        return moves, attacks
         
 class Knight(Piece):
+    __slots__ = ()
+    
     def __init__(self, name, color, location):
         self.location = location
+        moves, attacks = sharedTemplate(Knight, color)
+        super().__init__(name if name else 'Knight', color, moves, attacks, 4)
+    
+    @staticmethod
+    def buildTemplates(color):
         #centered at 7,7
         moves = np.zeros((15,15)) #[[0 for j in range(15)] for i in range(15)]
         attacks = np.zeros((15,15)) #[[0 for j in range(15)] for i in range(15)]
@@ -109,15 +155,21 @@ class Knight(Piece):
         
         moves[7][7] = -1
         attacks[7][7] = -1
-        
-        super().__init__(name if name else 'Knight', color, moves, attacks, 4)
+        return moves, attacks
         
 class King(Piece):
+    __slots__ = ('isAttacked', 'isChecked', 'castleMap')
+    
     def __init__(self, name, color, location):
         self.location = location
         self.isAttacked = False
         self.isChecked = False
-        self.castleMap = np.ones((1,8))
+        moves, attacks, self.castleMap = sharedTemplate(King, color)
+        super().__init__(name if name else 'King', color, moves, attacks, 6)
+    
+    @staticmethod
+    def buildTemplates(color):
+        castleMap = np.ones((1,8))
         #centered at 7,7
         moves = np.zeros((15,15)) #[[0 for j in range(15)] for i in range(15)]
         attacks = np.zeros((15,15)) #[[0 for j in range(15)] for i in range(15)]
@@ -140,17 +192,23 @@ class King(Piece):
         attacks[8][6] = 1
         attacks[6][8] = 1
         
-        self.castleMap[0,0] = 2
-        self.castleMap[0,7] = 2
+        castleMap[0,0] = 2
+        castleMap[0,7] = 2
         
         moves[7][7] = -1
         attacks[7][7] = -1
-        
-        super().__init__(name if name else 'King', color, moves, attacks, 6)
+        return moves, attacks, castleMap
         
 class Queen(Piece):
+    __slots__ = ()
+    
     def __init__(self, name, color, location):
         self.location = location
+        moves, attacks = sharedTemplate(Queen, color)
+        super().__init__(name if name else 'Queen', color, moves, attacks, 5)
+    
+    @staticmethod
+    def buildTemplates(color):
         #centered at 7,7
         moves = np.zeros((15,15)) #[[0 for j in range(15)] for i in range(15)]
         attacks = np.zeros((15,15)) #[[0 for j in range(15)] for i in range(15)]
@@ -168,18 +226,18 @@ class Queen(Piece):
 
         moves[7][7] = -1
         attacks[7][7] = -1
-        
-        super().__init__(name if name else 'Queen', color, moves, attacks, 5)
+        return moves, attacks
 
 PIECE_MAP = {0: Rook, 1: Knight, 2: Bishop, 3: King, 4: Queen, 5: Bishop, 6: Knight, 7: Rook}
 PIECE_NAME = {0: 'Rook', 1: 'Knight', 2: 'Bishop', 3: 'King', 4: 'Queen', 5: 'Bishop', 6: 'Knight', 7: 'Rook'}
+PIECE_TYPES = {1: Pawn, 2: Rook, 3: Bishop, 4: Knight, 5: Queen, 6: King}
 
 class Board:
-    def __init__(self, width, height, customSetup = None):
+    def __init__(self, width, height, customSetup = None, backend = 'array', log = print):
         self.width = width
         self.height = height
-        self.whiteEnPassant = False
-        self.blackEnPassant = False
+        self.enPassantSquare = None
+        self.enPassantPawns = []
         self.square = np.full((width , height), -1) #[[0 for j in range(height)] for i in range(width)]
         self.state = np.full((width,height), 0, dtype=object)
         self.whiteMoves = {}
@@ -187,11 +245,31 @@ class Board:
         self.moveTurn = 0
         self.whitePieces = {}
         self.blackPieces = {}
-        self.castle_Positions = [[0,1], [0,5], [7,1], [7,5]]
+        #undo records for pop()
+        self.history = []
+        #'array' uses the 15x15 move templates, 'bitboard' the attack tables in bitboard.py
+        self.backend = backend
+        #turn and game over messages from makeMove/endTurn go here
+        self.log = log
+        #tablebase.Tablebases consulted by checkEndGame, if any
+        self.tablebases = None
+        #plies since the last capture or pawn move, for the fifty-move rule
+        self.halfmoveClock = 0
+        #(zobristKey, len(history)) each colour's move map was generated for, see getMoveMap
+        self.moveMapKeys = {}
         if customSetup:
             customSetup(self)
         else:
             self.setupChess()
+        self.bitboards = bitboard.fromBoard(self)
+        #attack counts per colour, kept current by placePiece/removePiece
+        self.attackMap = bitboard.AttackMap(self.bitboards)
+        self.castlingRights = self.getCastlingRights()
+        self.zobristKey = zobrist.computeKey(self)
+        #times each zobristKey has stood on the board in this game, kept by push/pop for repetitions
+        self.repetitions = {self.zobristKey: 1}
+        #material per colour and white-relative middlegame/endgame scores, kept by placePiece/removePiece
+        self.material, self.mgScore, self.egScore, self.phase = evaluation.computeScores(self)
         self.getAllMoves(1)
         self.getAllMoves(2)
         
@@ -258,21 +336,10 @@ class Board:
         #cleanup attacks
         attacks = np.where(np.logical_and(piece.attacks[7-i:15-i,7-j:15-j] == 1, square == -1), 0, attacks)
         
-        if isinstance(piece, Pawn) and piece.enPassant:
-            if j < 7 and self.square[i,j+1] == 1 and self.state[i,j+1].color != piece.color:
-                x = i+1 if piece.color == 1 else i-1
-                y = j+1
+        if isinstance(piece, Pawn) and piece.enPassant and self.enPassantSquare:
+            x, y = self.enPassantSquare
+            if x == (i+1 if piece.color == 1 else i-1) and abs(y - j) == 1:
                 attacks[x,y] = 1
-            if j > 0 and self.square[i,j-1] == 1 and self.state[i,j-1].color != piece.color:
-                x = i+1 if piece.color == 1 else i-1
-                y = j-1
-                attacks[x,y] = 1
-           
-        #setDefenders
-        defended_locations = np.array(np.where(moves == 2)).T
-        for [i,j] in defended_locations:
-            if isinstance(state[i,j], Piece):
-                state[i,j].isDefended = True
 
         # Check Castle
         if not piece.hasMoved and isinstance(piece, King):
@@ -283,16 +350,10 @@ class Board:
             castle_moves[0, 2::-1] = np.cumprod(castle_moves[0, 2::-1])
             #right
             castle_moves[0, 4::] = np.cumprod(castle_moves[0, 4::], 0)
-            if piece.color == 1:
-                if castle_moves[0,0] == 2 and not self.whitePieces.get('Rook1').hasMoved:
-                    moves[0,1] = 1
-                if castle_moves[0,7] == 2 and not self.whitePieces.get('Rook2').hasMoved:
-                    moves[0,5] = 1
-            if piece.color == 2:
-                if castle_moves[0,0] == 2 and not self.blackPieces.get('Rook1').hasMoved:
-                    moves[7,1] = 1
-                if castle_moves[0,7] == 2 and not self.blackPieces.get('Rook2').hasMoved:
-                    moves[7,5] = 1
+            if castle_moves[0,0] == 2 and state[row,0].color == piece.color and not state[row,0].hasMoved:
+                moves[row,1] = 1
+            if castle_moves[0,7] == 2 and state[row,7].color == piece.color and not state[row,7].hasMoved:
+                moves[row,5] = 1
        
         #cleanup Moves
         moves = np.where(moves > 1, 0, moves)
@@ -358,6 +419,8 @@ class Board:
         
     
     def getAllMoves(self, color, state = [], square = [], future = False):
+        if self.backend == 'bitboard' and not future and len(state) == 0 and len(square) == 0:
+            return self.getAllMovesBitboard(color)
         if len(state) == 0:
             state = self.state
         if len(square) == 0:
@@ -365,6 +428,9 @@ class Board:
         curr_pieceMap = {}
         moves = [[]]
         attacks = [[]]
+        if not future:
+            #one attack/pin analysis serves every piece of this colour
+            safety = bitboard.KingSafety(self.bitboards, color, self.attackMap)
         for i in range(8):
             for j in range(8):
                 piece = state[i,j]
@@ -374,197 +440,476 @@ class Board:
                     allMoves = np.array(np.where(allMoves == 1)).T
                     
                     if not future and len(allMoves) > 0:
-                        allMoves = self.removeIllegalMoves(piece, allMoves)
+                        allMoves = self.removeIllegalMoves(piece, allMoves, safety)
                     curr_pieceMap[piece.name] = allMoves
         if not future:
             if color == 1:
                 self.whiteMoves = curr_pieceMap
             if color == 2:
                 self.blackMoves = curr_pieceMap
+            self.moveMapKeys[color] = (self.zobristKey, len(self.history))
         if len(curr_pieceMap.values()) == 0:
             return 0
         return np.concatenate(list(curr_pieceMap.values()))
 
-    def removeIllegalMoves(self, piece, allMoves):
-        movesToDelete = []
-        for [i,j] in allMoves:
-            if isinstance(piece, King) and (isinstance(self.state[i,j], Piece) and self.state[i,j].isDefended):
-                #King cannot attack a defended Piece
-                movesToDelete.append([i,j])
-            else:
-                state_copy = self.state.copy()
-                square_copy = self.square.copy()
-                state_copy[piece.location[0], piece.location[1]] = 0
-                state_copy[i, j] = piece
-                
-                square_copy[piece.location[0], piece.location[1]] = -1
-                square_copy[i, j] = piece.num
-                
-                if isinstance(piece, King):
-                    king_location = [i,j]
-                else:
-                    king_location = self.whitePieces.get('King1').location if piece.color == 1 else self.blackPieces.get('King1').location
-                
-                new_allAttacks = self.getAllMoves((piece.color%2) +1, state_copy, square_copy, True)
-                
-                if not piece.hasMoved and isinstance(piece, King):
-                    if j == 1:
-                        castle_Positions = [[0,1], [0,2]] if piece.color == 1 else [[7,1], [7,2]]
-                        for i in castle_Positions:
-                            if i in new_allAttacks.tolist():
-                                movesToDelete.append([i,j])
-                                break
-                    if j == 7:
-                        castle_Positions = [[0,4],[0,5]] if piece.color == 1 else [[7,4], [7,5]]
-                        for i in castle_Positions:
-                            if i in new_allAttacks.tolist():
-                                movesToDelete.append([i,j])
-                                break
-                
-                if isinstance(new_allAttacks, np.ndarray) and king_location in new_allAttacks.tolist():
-                    movesToDelete.append([i,j])
-        indexToDelete = []
-        for i in range(len(allMoves)):
-            if allMoves[i].tolist() in movesToDelete:
-                indexToDelete.append(i)
-        allMoves = np.delete(allMoves, indexToDelete, axis=0)
-        return allMoves
-        
-    def checkEndGame(self, current_player, next_player):
-        current_allMoves = self.getAllMoves(current_player)
-        next_king = self.whitePieces.get('King1') if (self.moveTurn%2) == 0 else self.blackPieces.get('King1')
-        if next_king.location in current_allMoves.tolist():
-            next_king.isChecked = True
-        next_allMoves = self.getAllMoves(next_player)
-        nextPlayerMoveMap = self.whiteMoves if (self.moveTurn%2) == 0 else self.blackMoves
-        currentPlayerMoveMap = self.whiteMoves if (self.moveTurn%2) == 1 else self.blackMoves
-        nextPlayerKing = self.whitePieces.get('King1') if (self.moveTurn%2) == 0 else self.blackPieces.get('King1')
-        if next_allMoves.size == 0:
-            if nextPlayerKing.isChecked:
-                print('Game Over - Check Mate')
-                print('Result - ' + ('White' if (self.moveTurn%2) == 1 else 'Black') + ' Wins')
-                return 0
-            else:
-                print('Game Over - Stale Mate')
-                print('Result - Tie')
-                return 0
-    
-    def resetEnPassant(self, curr_pieces, color):
-        for piece in curr_pieces.values():
-            if isinstance(piece, Pawn):
-                piece.enPassant = False
+    def getAllMovesBitboard(self, color):
+        curr_pieceMap = bitboard.getAllMoves(self, color)
+        self.moveMapKeys[color] = (self.zobristKey, len(self.history))
         if color == 1:
-            self.whiteEnPassant = False
+            self.whiteMoves = curr_pieceMap
         if color == 2:
-            self.blackEnPasant = False
+            self.blackMoves = curr_pieceMap
+        if len(curr_pieceMap.values()) == 0:
+            return 0
+        return np.concatenate(list(curr_pieceMap.values()))
+
+    def removeIllegalMoves(self, piece, allMoves, safety = None):
+        if safety is None:
+            safety = bitboard.KingSafety(self.bitboards, piece.color, self.attackMap)
+        legal = [bitboard.isLegalMove(self.bitboards, safety, self.encodeMove(piece, move), piece.color) for move in allMoves]
+        return allMoves[np.array(legal, dtype=bool)]
+        
+    def getMoveMap(self, color):
+        # {piece name: legal [i,j] targets} for color, regenerated only if the position changed since
+        if self.moveMapKeys.get(color) != (self.zobristKey, len(self.history)):
+            self.getAllMoves(color)
+        return self.whiteMoves if color == 1 else self.blackMoves
+
+    def hasLegalMove(self, color = None):
+        # stops at the first legal move instead of generating them all
+        if color is None:
+            color = (self.moveTurn%2)+1
+        return bitboard.hasLegalMove(self, color)
+
+    def isDraw(self):
+        # fifty-move rule, threefold repetition or insufficient material, cheap enough for every ply
+        #phase counts minor pieces 1, rooks 2 and queens 4, so more than 2 always leaves mating material
+        return (self.halfmoveClock >= 100 or self.repetitions.get(self.zobristKey, 0) >= 3
+                or (self.phase <= 2 and bitboard.insufficientMaterial(self.bitboards)))
+
+    def gameStatus(self):
+        # 'checkmate', 'stalemate', 'fifty-move', 'repetition', 'insufficient material', or None while play goes on
+        if not self.hasLegalMove():
+            return 'checkmate' if self.inCheck() else 'stalemate'
+        if self.halfmoveClock >= 100:
+            return 'fifty-move'
+        if self.repetitions.get(self.zobristKey, 0) >= 3:
+            return 'repetition'
+        if bitboard.insufficientMaterial(self.bitboards):
+            return 'insufficient material'
+        return None
+
+    def checkEndGame(self, current_player, next_player):
+        next_king = self.whitePieces.get('King1') if (self.moveTurn%2) == 0 else self.blackPieces.get('King1')
+        next_king.isChecked = self.inCheck(next_player)
+        status = self.gameStatus()
+        if status == 'checkmate':
+            self.log('Game Over - Check Mate')
+            self.log('Result - ' + ('White' if (self.moveTurn%2) == 1 else 'Black') + ' Wins')
+            return 0
+        if status == 'stalemate':
+            self.log('Game Over - Stale Mate')
+            self.log('Result - Tie')
+            return 0
+        if status is not None:
+            self.log('Game Over - Draw by ' + status)
+            self.log('Result - Tie')
+            return 0
+        if self.tablebases is not None:
+            found = self.tablebases.probe(self)
+            if found and found[0] == 'draw':
+                self.log('Tablebase - Draw')
+            elif found:
+                winner = next_player if found[0] == 'win' else current_player
+                self.log('Tablebase - ' + ('White' if winner == 1 else 'Black') + ' mates in ' + str((found[1] + 1)//2))
                 
     def endTurn(self):
-        resetDefended(self.state)
-        if self.blackEnPassant and self.moveTurn%2 == 1:
-            self.resetEnPassant(self.blackPieces, 2)
-        if self.whiteEnPassant and self.moveTurn%2 == 0:
-            self.resetEnPassant(self.whitePieces, 1)
-        current_player = (self.moveTurn%2)+1
-        self.moveTurn += 1
+        current_player = ((self.moveTurn-1)%2)+1
         next_player = (self.moveTurn%2)+1
         self.checkEndGame(current_player, next_player)
-        print("Turn: " + str(self.moveTurn))
+        self.log("Turn: " + str(self.moveTurn))
+
+    def placePiece(self, piece, i, j):
+        self.state[i,j] = piece
+        self.square[i,j] = piece.num
+        piece.square = int(i)*8 + int(j)
+        self.bitboards.add(piece.color, piece.num, i*8 + j)
+        self.attackMap.add(self.bitboards, piece.color, piece.num, i*8 + j)
+        self.zobristKey ^= zobrist.PIECE_KEYS[piece.color][piece.num][i*8 + j]
+        self.material[piece.color] += evaluation.PIECE_VALUES[piece.num]
+        self.mgScore += evaluation.MG_TABLE[piece.color][piece.num][i*8 + j]
+        self.egScore += evaluation.EG_TABLE[piece.color][piece.num][i*8 + j]
+        self.phase += evaluation.PHASE_WEIGHTS[piece.num]
+
+    def removePiece(self, i, j):
+        piece = self.state[i,j]
+        self.state[i,j] = 0
+        self.square[i,j] = -1
+        self.bitboards.remove(piece.color, piece.num, i*8 + j)
+        self.attackMap.remove(self.bitboards, i*8 + j)
+        self.zobristKey ^= zobrist.PIECE_KEYS[piece.color][piece.num][i*8 + j]
+        self.material[piece.color] -= evaluation.PIECE_VALUES[piece.num]
+        self.mgScore -= evaluation.MG_TABLE[piece.color][piece.num][i*8 + j]
+        self.egScore -= evaluation.EG_TABLE[piece.color][piece.num][i*8 + j]
+        self.phase -= evaluation.PHASE_WEIGHTS[piece.num]
+        return piece
         
     def makeCastleMove(self, piece, rook, move):
-        rook_i, rook_j = move[0], st.mean([piece.location[1], move[1]])
+        rook_i, rook_j = move[0], (piece.location[1] + move[1])//2
         
-        self.state[rook.location[0], rook.location[1]] = 0
-        self.state[rook_i, rook_j] = rook
+        self.removePiece(rook.location[0], rook.location[1])
+        self.placePiece(rook, rook_i, rook_j)
         
-        self.square[rook.location[0], rook.location[1]] = -1
-        self.square[rook_i, rook_j] = rook.num
-        
-        rook.location = [rook_i, rook_j]
         rook.hasMoved = True
         
-    def promotePawn(self, pawn, pieces):
+    def promotePawn(self, pawn, pieces, pieceType = None):
+        if pieceType is None:
+            pieceType = Queen
+        name = pieceType.__name__
         num = 3
-        for i in range(8):
-            if ('Queen'+str(num)) in pieces.keys():
-                num += 1
-            else:
-                break
-        queen = Queen('Queen'+str(num), pawn.color, pawn.location)
+        while (name+str(num)) in pieces.keys():
+            num += 1
+        promoted = pieceType(name+str(num), pawn.color, pawn.location)
+        promoted.hasMoved = True
         
-        self.state[pawn.location[0], pawn.location[1]] = queen
-        
-        self.square[pawn.location[0], pawn.location[1]] = queen.num
+        self.removePiece(pawn.location[0], pawn.location[1])
+        self.placePiece(promoted, pawn.location[0], pawn.location[1])
         
         del pieces[pawn.name]
-        pieces[queen.name] = queen
+        pieces[promoted.name] = promoted
         
-        return queen
+        return promoted
+
+    def getMoveList(self, color = None):
+        # legal moves as encoded ints, underpromotions included
+        if color is None:
+            color = (self.moveTurn%2)+1
+        if self.backend == 'bitboard':
+            return bitboard.legalMoves(self, color)
+        self.getAllMoves(color)
+        pieces = self.whitePieces if color == 1 else self.blackPieces
+        moveList = []
+        for name, targets in (self.whiteMoves if color == 1 else self.blackMoves).items():
+            for target in targets:
+                move = self.encodeMove(pieces[name], target)
+                if bitboard.movePromotion(move):
+                    moveList.extend(move & 4095 | promotion << 12 for promotion in bitboard.PROMOTIONS)
+                else:
+                    moveList.append(move)
+        return moveList
+
+    def generateMoves(self, hashMove = None, killers = (), orderer = None, ply = 0):
+        # Legal moves in stages: the hash move, captures and promotions, killers, quiet moves and, with
+        # an orderer (ordering.MoveOrderer), the captures that lose material last. A stage is generated
+        # only once the one before it is used up and each move is legality checked as it is yielded,
+        # so a caller that stops at a cutoff pays for nothing it did not search. Bitboard backend only.
+        color = (self.moveTurn%2)+1
+        bb = self.bitboards
+        safety = []
+        def legal(move):
+            if not safety:
+                safety.append(bitboard.KingSafety(bb, color, self.attackMap))
+            return bitboard.isLegalMove(bb, safety[0], move, color)
+
+        tried = []
+        if hashMove is not None and bitboard.isPseudoLegal(self, bb, hashMove, color):
+            tried.append(hashMove)
+            if legal(hashMove):
+                yield hashMove
+
+        captures = bitboard.captureMoves(self, bb, color)
+        losing = []
+        if orderer is not None:
+            scores = {move: orderer.score(self, move, ply, color) for move in captures}
+            captures.sort(key=scores.__getitem__, reverse=True)
+            losing = [move for move in captures if scores[move] < 0]
+            captures = captures[:len(captures) - len(losing)]
+        for move in captures:
+            if move not in tried and legal(move):
+                yield move
+
+        for move in killers:
+            if move is None or move in tried:
+                continue
+            #a killer comes from a sibling position, it has to be a quiet move here too
+            origin = 1 << bitboard.moveFrom(move)
+            if move in bitboard.quietMoves(self, bb, color, origin):
+                tried.append(move)
+                if legal(move):
+                    yield move
+
+        quiets = bitboard.quietMoves(self, bb, color)
+        if orderer is not None:
+            history = orderer.history[color]
+            quiets.sort(key=lambda move: history[move & 4095], reverse=True)
+        for move in quiets:
+            if move not in tried and legal(move):
+                yield move
+
+        for move in losing:
+            if move not in tried and legal(move):
+                yield move
+
+    def inCheck(self, color = None):
+        if color is None:
+            color = (self.moveTurn%2)+1
+        king = self.bitboards.pieces[color][bitboard.KING]
+        if not king:
+            return False
+        return self.attackMap.isAttacked(king.bit_length() - 1, (color%2)+1)
+
+    def bookMoves(self, book):
+        # weighted book moves for this position, checked for legality in case of a key collision
+        legal = self.getMoveList()
+        return [(move, weight) for move, weight in book.lookup(self.zobristKey) if move in legal]
+
+    def isDefended(self, piece):
+        i, j = piece.location
+        return self.attackMap.isAttacked(i*8 + j, piece.color)
+
+    def encodeMove(self, piece, move, promotion = bitboard.QUEEN):
+        end_row = 7 if piece.color == 1 else 0
+        if not isinstance(piece, Pawn) or move[0] != end_row:
+            promotion = 0
+        start = piece.square
+        return bitboard.encodeMove(start, bitboard.squareIndex(int(move[0]), int(move[1])), promotion)
+
+    def getCastlingRights(self):
+        # bit set per castle still available, in FEN order KQkq
+        rights = 0
+        for bit, (row, col) in enumerate(FEN_CASTLING.values()):
+            king, rook = self.state[row,3], self.state[row,col]
+            if (isinstance(king, King) and isinstance(rook, Rook) and king.color == rook.color == (1 if row == 0 else 2)
+                    and not king.hasMoved and not rook.hasMoved):
+                rights |= 1 << bit
+        return rights
+
+    def push(self, move):
+        key, castlingRights, halfmoveClock = self.zobristKey, self.castlingRights, self.halfmoveClock
+        start, end = bitboard.moveFrom(move), bitboard.moveTo(move)
+        i, j, x, y = start >> 3, start & 7, end >> 3, end & 7
+        piece = self.state[i,j]
+        currentPieces = self.whitePieces if piece.color == 1 else self.blackPieces
+        otherPieces = self.blackPieces if piece.color == 1 else self.whitePieces
+        
+        captured_piece, captured_location = None, None
+        if self.square[x,y] != -1:
+            captured_location = [x,y]
+        elif isinstance(piece, Pawn) and j != y:
+            #En Passant
+            captured_location = [i,y]
+        if captured_location:
+            captured_piece = self.removePiece(captured_location[0], captured_location[1])
+            del otherPieces[captured_piece.name]
+        
+        rook, rook_hasMoved = None, False
+        if isinstance(piece, King) and abs(y - j) == 2:
+            rook = self.state[i, 0 if y < j else 7]
+            rook_hasMoved = rook.hasMoved
+            self.makeCastleMove(piece, rook, [x,y])
+        
+        hasMoved = piece.hasMoved
+        self.removePiece(i, j)
+        self.placePiece(piece, x, y)
+        piece.hasMoved = True
+        
+        promoted = None
+        if bitboard.movePromotion(move):
+            promoted = self.promotePawn(piece, currentPieces, PIECE_TYPES[bitboard.movePromotion(move)])
+        
+        # pawns that could take en passant lose the right, a double step hands it to neighbouring enemy pawns
+        enPassantSquare, enPassantPawns = self.enPassantSquare, self.enPassantPawns
+        if enPassantPawns:
+            self.zobristKey ^= zobrist.EN_PASSANT_KEYS[enPassantSquare[1]]
+        for pawn in enPassantPawns:
+            pawn.enPassant = False
+        self.enPassantSquare, self.enPassantPawns = None, []
+        if isinstance(piece, Pawn) and abs(x - i) == 2:
+            self.enPassantSquare = [(i + x)//2, j]
+            for neighbour in (y - 1, y + 1):
+                if 0 <= neighbour < 8 and isinstance(self.state[x, neighbour], Pawn) and self.state[x, neighbour].color != piece.color:
+                    self.state[x, neighbour].enPassant = True
+                    self.enPassantPawns.append(self.state[x, neighbour])
+            if self.enPassantPawns:
+                self.zobristKey ^= zobrist.EN_PASSANT_KEYS[j]
+        
+        if castlingRights and (start in CASTLING_SQUARES or end in CASTLING_SQUARES):
+            self.castlingRights = self.getCastlingRights()
+            self.zobristKey ^= zobrist.CASTLING_KEYS[castlingRights] ^ zobrist.CASTLING_KEYS[self.castlingRights]
+        self.zobristKey ^= zobrist.SIDE_KEY
+        self.repetitions[self.zobristKey] = self.repetitions.get(self.zobristKey, 0) + 1
+        self.halfmoveClock = 0 if captured_piece or isinstance(piece, Pawn) else halfmoveClock + 1
+        
+        self.history.append((move, piece, hasMoved, captured_piece, captured_location, rook, rook_hasMoved,
+                             promoted, enPassantSquare, enPassantPawns, key, castlingRights, halfmoveClock))
+        self.moveTurn += 1
+        
+    def pop(self):
+        (move, piece, hasMoved, captured_piece, captured_location, rook, rook_hasMoved,
+         promoted, enPassantSquare, enPassantPawns, key, castlingRights, halfmoveClock) = self.history.pop()
+        if self.repetitions[self.zobristKey] == 1:
+            del self.repetitions[self.zobristKey]
+        else:
+            self.repetitions[self.zobristKey] -= 1
+        self.moveTurn -= 1
+        start, end = bitboard.moveFrom(move), bitboard.moveTo(move)
+        i, j, x, y = start >> 3, start & 7, end >> 3, end & 7
+        currentPieces = self.whitePieces if piece.color == 1 else self.blackPieces
+        otherPieces = self.blackPieces if piece.color == 1 else self.whitePieces
+        
+        for pawn in self.enPassantPawns:
+            pawn.enPassant = False
+        for pawn in enPassantPawns:
+            pawn.enPassant = True
+        self.enPassantSquare, self.enPassantPawns = enPassantSquare, enPassantPawns
+        
+        self.removePiece(x, y)
+        if promoted:
+            del currentPieces[promoted.name]
+            currentPieces[piece.name] = piece
+        self.placePiece(piece, i, j)
+        piece.hasMoved = hasMoved
+        
+        if rook:
+            self.removePiece(rook.location[0], rook.location[1])
+            self.placePiece(rook, i, 0 if y < j else 7)
+            rook.hasMoved = rook_hasMoved
+        
+        if captured_piece:
+            self.placePiece(captured_piece, captured_location[0], captured_location[1])
+            otherPieces[captured_piece.name] = captured_piece
+        self.zobristKey, self.castlingRights, self.halfmoveClock = key, castlingRights, halfmoveClock
+        return move
     
-    def makeMove(self, piece, move):
+    def makeMove(self, piece, move, promotion = bitboard.QUEEN):
         result = 0
         if isinstance(piece, Piece) and (piece.color - 1) == (self.moveTurn%2):
-            currentMoves = self.whiteMoves if (self.moveTurn%2) == 0 else self.blackMoves
-            currentPieces = self.whitePieces if (self.moveTurn%2) == 0 else self.whitePieces
+            currentMoves = self.getMoveMap(piece.color)
             if move in currentMoves.get(piece.name).tolist():
                 result = 1
-                if not piece.hasMoved:
-                    if isinstance(piece, King):
-                        if move in self.castle_Positions:
-                            rook = currentPieces.get('Rook1') if move[1] < 3 else currentPieces.get('Rook2')
-                            self.makeCastleMove(piece, rook, move)
-                            result = rook.name
-                    if isinstance(piece, Pawn):
-                        # Enable En Passant
-                        if abs(move[0] - piece.location[0]) == 2:
-                            if move[1] < 7 and isinstance(self.state[move[0], move[1]+1], Pawn) and self.state[move[0], move[1]+1].color != piece.color:
-                                self.state[move[0], move[1]+1].enPassant = True
-                                if piece.color == 2:
-                                    self.whiteEnPassant = True
-                                else:
-                                    self.blackEnPassant = True
-                            if move[1] > 0 and isinstance(self.state[move[0], move[1]-1], Pawn) and self.state[move[0], move[1]-1].color != piece.color:
-                                self.state[move[0], move[1]-1].enPassant = True
-                                if piece.color == 2:
-                                    self.whiteEnPassant = True
-                                else:
-                                    self.blackEnPassant = True
-            
-                captured_piece = None
-                if isinstance(piece, Pawn) and piece.enPassant:
-                    if move[1] != piece.location[1]:
-                        captured_piece = self.state[move[0]-1, move[1]]
-                        result = 'En Passant'
-                if captured_piece == None:
-                    captured_piece = self.state[move[0], move[1]]
-                if isinstance(captured_piece, Piece):
-                    del currentPieces[captured_piece.name]
-                self.state[piece.location[0], piece.location[1]] = 0
-                self.state[move[0], move[1]] = piece
+                i, j = piece.location
+                if isinstance(piece, King) and abs(move[1] - j) == 2:
+                    result = self.state[i, 0 if move[1] < j else 7].name
+                if isinstance(piece, Pawn) and move[1] != j and self.square[move[0], move[1]] == -1:
+                    result = 'En Passant'
                 
-                self.square[piece.location[0], piece.location[1]] = -1
-                self.square[move[0], move[1]] = piece.num
-                
-                piece.location = move
-                piece.hasMoved = True
-                
-                #Pawn Promotion
-                end_row = 7 if piece.color == 1 else 0
-                if isinstance(piece, Pawn) and move[0] == end_row:
-                    #pawn will promote
-                    queen = self.promotePawn(piece, currentPieces)
-                    result = 'Queen'
+                encoded = self.encodeMove(piece, move, promotion)
+                if bitboard.movePromotion(encoded):
+                    #pawn will promote, result names the new piece
+                    result = PIECE_TYPES[bitboard.movePromotion(encoded)].__name__
+                self.push(encoded)
                 
                 self.endTurn()
                 return result
             else:
-                print("Invalid Move")
+                self.log("Invalid Move")
                 return result
         else:
-            print("Turn Error")
+            self.log("Turn Error")
             return result
             
         
 
+FEN_PIECES = {'p': Pawn, 'r': Rook, 'b': Bishop, 'n': Knight, 'q': Queen, 'k': King}
+#FEN castling letter: (row, rook column)
+FEN_CASTLING = {'K': (0,0), 'Q': (0,7), 'k': (7,0), 'q': (7,7)}
+
+def setupPosition(board, placements, moveTurn, castlingRights = 0, enPassantSquare = None):
+    # placements are (i, j, pieceType, color); pieces are named in square order like setupChess
+    counts = {}
+    for i, j, pieceType, color in sorted(placements, key=lambda placement: placement[:2]):
+        counts[color, pieceType] = counts.get((color, pieceType), 0) + 1
+        piece = pieceType(pieceType.__name__ + str(counts[color, pieceType]), color, [i,j])
+        board.state[i,j] = piece
+        board.square[i,j] = piece.num
+        pieces = board.whitePieces if color == 1 else board.blackPieces
+        pieces[piece.name] = piece
+        if isinstance(piece, Pawn):
+            piece.hasMoved = i != (1 if color == 1 else 6)
+        if isinstance(piece, (King, Rook)):
+            piece.hasMoved = True
+    
+    for bit, (row, col) in enumerate(FEN_CASTLING.values()):
+        if castlingRights & (1 << bit) and isinstance(board.state[row,col], Rook) and isinstance(board.state[row,3], King):
+            board.state[row,col].hasMoved = False
+            board.state[row,3].hasMoved = False
+    
+    board.moveTurn = moveTurn
+    if enPassantSquare is not None:
+        board.enPassantSquare = list(enPassantSquare)
+        black = moveTurn%2 == 1
+        x = enPassantSquare[0] + (1 if black else -1)
+        for y in (enPassantSquare[1] - 1, enPassantSquare[1] + 1):
+            if 0 <= y < 8 and isinstance(board.state[x,y], Pawn) and board.state[x,y].color == (2 if black else 1):
+                board.state[x,y].enPassant = True
+                board.enPassantPawns.append(board.state[x,y])
+
+def fenSetup(fen):
+    # customSetup callback for a FEN string. Rows run from rank 1 (i = 0) up and files from h (j = 0) to a
+    def setup(board):
+        fields = fen.split()
+        placements = []
+        for r, row in enumerate(fields[0].split('/')):
+            i, j = 7 - r, 7
+            for letter in row:
+                if letter.isdigit():
+                    j -= int(letter)
+                    continue
+                placements.append((i, j, FEN_PIECES[letter.lower()], 1 if letter.isupper() else 2))
+                j -= 1
+        
+        castlingRights = 0
+        castling = fields[2] if len(fields) > 2 else '-'
+        for letter in castling.replace('-', ''):
+            castlingRights |= 1 << list(FEN_CASTLING).index(letter)
+        black = len(fields) > 1 and fields[1] == 'b'
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+        enPassantSquare = None
+        if len(fields) > 3 and fields[3] != '-':
+            enPassantSquare = [int(fields[3][1]) - 1, bitboard.FILES.index(fields[3][0])]
+        setupPosition(board, placements, 2*(fullmove - 1) + (1 if black else 0), castlingRights, enPassantSquare)
+        board.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+    return setup
+
+def toFen(board):
+    # FEN for the position, the inverse of fenSetup
+    rows = []
+    for i in range(7, -1, -1):
+        row, empty = '', 0
+        for j in range(7, -1, -1):
+            piece = board.state[i,j]
+            if not isinstance(piece, Piece):
+                empty += 1
+                continue
+            if empty:
+                row += str(empty)
+                empty = 0
+            letter = [letter for letter, pieceType in FEN_PIECES.items() if pieceType is type(piece)][0]
+            row += letter.upper() if piece.color == 1 else letter
+        rows.append(row + (str(empty) if empty else ''))
+    castling = ''.join(letter for bit, letter in enumerate(FEN_CASTLING) if board.getCastlingRights() & (1 << bit))
+    enPassant = '-'
+    if board.enPassantSquare:
+        enPassant = bitboard.squareName(bitboard.squareIndex(*board.enPassantSquare))
+    return '%s %s %s %s %d %d' % ('/'.join(rows), 'b' if board.moveTurn%2 else 'w', castling or '-', enPassant,
+                                  board.halfmoveClock, board.moveTurn//2 + 1)
+
+def arraySetup(squares, colors, moveTurn, castlingRights = 0, enPassant = -1):
+    # customSetup callback for the Board.square encoding plus a colour plane (see batch.py)
+    def setup(board):
+        squares_flat = np.asarray(squares).reshape(64)
+        colors_flat = np.asarray(colors).reshape(64)
+        placements = [(sq >> 3, sq & 7, PIECE_TYPES[int(squares_flat[sq])], int(colors_flat[sq]))
+                      for sq in np.flatnonzero(squares_flat != -1).tolist()]
+        enPassantSquare = bitboard.squareLocation(int(enPassant)) if enPassant >= 0 else None
+        setupPosition(board, placements, int(moveTurn), int(castlingRights), enPassantSquare)
+    return setup
+
+#king and rook home squares, a move from or to one of them can change castling rights
+CASTLING_SQUARES = {bitboard.squareIndex(row, col) for row in (0, 7) for col in (0, 3, 7)}
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
 def testBoard(board):
     board.state[0,0] = King('King1', 2, [0,0])
     board.square[0,0] = board.state[0,0].num
@@ -0,0 +1,482 @@
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+import numpy as np
+
+import bitboard
+import positions
+import ordering
+from ordering import MoveOrderer
+from chess import Board, fenSetup, START_FEN
+from evaluation import evaluate
+from transposition import TranspositionTable, EXACT, LOWER, UPPER, DEFAULT_MEGABYTES as DEFAULT_HASH_MB
+
+MATE = 100000
+INFINITY = MATE + 1
+#how many nodes pass between clock checks
+CHECK_INTERVAL = 256
+#quiescence: a capture is skipped when even winning its victim plus this margin cannot lift the
+#stand-pat score to alpha
+DELTA_MARGIN = 200
+#plies below the root past which quiescence stops and evaluates
+MAX_PLY = 100
+
+def isMateScore(score):
+    return abs(score) > MATE - 1000
+
+def scoreToTable(score, ply):
+    # mate scores are stored as distance from the node, not from the root
+    if isMateScore(score):
+        return score + ply if score > 0 else score - ply
+    return score
+
+def scoreFromTable(score, ply):
+    if isMateScore(score):
+        return score - ply if score > 0 else score + ply
+    return score
+
+class SearchStopped(Exception):
+    pass
+
+class SearchResult:
+    # nodes counts every node searched, qnodes the share of them in quiescence
+    def __init__(self, move, score, pv, nodes, depth, seconds, qnodes = 0):
+        self.move = move
+        self.score = score
+        self.pv = pv
+        self.nodes = nodes
+        self.qnodes = qnodes
+        self.depth = depth
+        self.seconds = seconds
+
+    def nps(self):
+        return self.nodes / self.seconds if self.seconds > 0 else 0
+
+    def __repr__(self):
+        return 'SearchResult(move=%s, score=%d, depth=%d, nodes=%d, qnodes=%d, pv=%s)' % (
+            bitboard.moveName(self.move) if self.move is not None else None, self.score, self.depth, self.nodes,
+            self.qnodes, ' '.join(bitboard.moveName(move) for move in self.pv))
+
+class Engine:
+    def __init__(self, evaluate = evaluate, book = None, tablebases = None, ordering = True, table = None,
+                 quiescence = True, evasions = False):
+        self.evaluate = evaluate
+        #MVV-LVA/SEE, killer and history ordering, None searches moves in generation order
+        self.orderer = MoveOrderer() if ordering else None
+        #an opening book (book.Book) answered from before any search
+        self.book = book
+        #tablebase.Tablebases, probed for exact scores below the root
+        self.tablebases = tablebases
+        #transposition.TranspositionTable kept across searches, None for no table
+        self.table = table
+        #leaves are searched on through captures and promotions, and with evasions every reply to a check
+        self.quiescence = quiescence
+        self.evasions = evasions
+        self.nodes = 0
+        self.qnodes = 0
+        self.stopped = False
+        self.deadline = None
+        self.nodeLimit = None
+
+    def stop(self):
+        # Safe to call from another thread, the search unwinds at its next clock check. The flag is
+        # only cleared by building the Engine, so a stop that lands before search() starts still counts
+        self.stopped = True
+
+    def search(self, board, maxDepth = 64, timeLimit = None, nodeLimit = None, callback = None):
+        # Iterative deepening negamax. Returns the result of the deepest completed iteration;
+        # an iteration cut short by the time or node budget is thrown away.
+        start = time.perf_counter()
+        self.deadline = start + timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.nodes = 0
+        self.qnodes = 0
+        root_ply = len(board.history)
+        color = (board.moveTurn%2)+1
+        rootMoves = bitboard.legalMoves(board, color)
+        if not rootMoves:
+            score = -MATE if board.inCheck() else 0
+            return SearchResult(None, score, [], 0, 0, 0.0)
+        if self.book is not None:
+            move = self.book.choose(board)
+            if move is not None:
+                return SearchResult(move, 0, [move], 0, 0, time.perf_counter() - start)
+
+        if self.table is not None:
+            self.table.newSearch()
+        if self.orderer is not None:
+            self.orderer.clear()
+            rootMoves = self.orderer.order(board, rootMoves, 0)
+        best = SearchResult(rootMoves[0], 0, [rootMoves[0]], 0, 0, 0.0)
+        pv = []
+        for depth in range(1, maxDepth + 1):
+            try:
+                score, pv = self.searchRoot(board, rootMoves, depth, pv)
+            except SearchStopped:
+                while len(board.history) > root_ply:
+                    board.pop()
+                break
+            best = SearchResult(pv[0], score, pv, self.nodes, depth, time.perf_counter() - start, self.qnodes)
+            if callback:
+                callback(best)
+            if isMateScore(score) or len(rootMoves) == 1:
+                break
+            if self.deadline is not None and time.perf_counter() > self.deadline:
+                break
+        best.nodes = self.nodes
+        best.qnodes = self.qnodes
+        best.seconds = time.perf_counter() - start
+        return best
+
+    def searchRoot(self, board, rootMoves, depth, pv):
+        #the previous iteration's best move goes first
+        if pv:
+            rootMoves.remove(pv[0])
+            rootMoves.insert(0, pv[0])
+        alpha, beta = -INFINITY, INFINITY
+        best_pv = None
+        for move in rootMoves:
+            board.push(move)
+            score, child_pv = self.negamax(board, depth - 1, -beta, -alpha, 1, pv[1:] if pv and move == pv[0] else [])
+            score = -score
+            board.pop()
+            if score > alpha:
+                alpha = score
+                best_pv = [move] + child_pv
+        return alpha, best_pv
+
+    def negamax(self, board, depth, alpha, beta, ply, pv):
+        if depth == 0 and self.quiescence:
+            #a leaf is the first quiescence node and counted there
+            return self.quiesce(board, alpha, beta, ply), []
+        self.nodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            self.checkLimits()
+        if self.tablebases is not None:
+            found = self.tablebases.probe(board)
+            if found is not None:
+                outcome, plies = found
+                if outcome == 'draw':
+                    return 0, []
+                return (MATE - ply - plies if outcome == 'win' else -MATE + ply + plies), []
+        if board.isDraw():
+            return 0, []
+        if depth == 0:
+            return self.evaluate(board), []
+
+        hashMove = pv[0] if pv else None
+        if self.table is not None:
+            entry = self.table.probe(board.zobristKey)
+            if entry is not None:
+                move, score, stored_depth, bound = entry
+                if hashMove is None and move:
+                    hashMove = move
+                #off the previous iteration's pv, so that line is searched again and kept whole
+                if stored_depth >= depth and not pv:
+                    score = scoreFromTable(score, ply)
+                    if bound == EXACT or (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha):
+                        return score, []
+
+        color = (board.moveTurn%2)+1
+        if self.orderer is not None:
+            #staged and lazy, a cutoff skips generating and legality checking the moves after it
+            moves = board.generateMoves(hashMove, tuple(self.orderer.killers[ply]), self.orderer, ply)
+        else:
+            moves = bitboard.legalMoves(board, color)
+            if hashMove in moves:
+                moves.remove(hashMove)
+                moves.insert(0, hashMove)
+
+        original_alpha = alpha
+        best_pv = []
+        searched = 0
+        for move in moves:
+            searched += 1
+            board.push(move)
+            score, child_pv = self.negamax(board, depth - 1, -beta, -alpha, ply + 1,
+                                           pv[1:] if pv and move == pv[0] else [])
+            score = -score
+            board.pop()
+            if score >= beta:
+                if self.orderer is not None:
+                    self.orderer.cutoff(board, move, ply, depth)
+                if self.table is not None:
+                    self.table.store(board.zobristKey, move, scoreToTable(score, ply), depth, LOWER)
+                return score, []
+            if score > alpha:
+                alpha = score
+                best_pv = [move] + child_pv
+        if not searched:
+            return (-MATE + ply if board.inCheck(color) else 0), []
+        if self.table is not None:
+            self.table.store(board.zobristKey, best_pv[0] if best_pv else 0, scoreToTable(alpha, ply), depth,
+                             EXACT if alpha > original_alpha else UPPER)
+        return alpha, best_pv
+
+    def quiesce(self, board, alpha, beta, ply):
+        # Search captures and queen promotions until the position is quiet. The side to move may
+        # stand pat on the static score; captures that cannot reach alpha (delta pruning) or that
+        # lose material by SEE are skipped. With evasions a side in check must answer it instead.
+        self.nodes += 1
+        self.qnodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            self.checkLimits()
+        if board.isDraw():
+            return 0
+        color = (board.moveTurn%2)+1
+        if self.evasions and ply < MAX_PLY and board.inCheck(color):
+            return self.quiesceEvasions(board, alpha, beta, ply)
+        standPat = self.evaluate(board)
+        if standPat >= beta or ply >= MAX_PLY:
+            return standPat
+        alpha = max(alpha, standPat)
+
+        bb = board.bitboards
+        captures = []
+        for move in bitboard.captureMoves(board, bb, color):
+            promotion = bitboard.movePromotion(move)
+            if promotion and promotion != bitboard.QUEEN:
+                continue
+            victim = ordering.capturedKind(board, move)
+            gain = ordering.SEE_VALUES[victim] if victim else 0
+            if promotion:
+                gain += ordering.SEE_VALUES[promotion] - ordering.SEE_VALUES[bitboard.PAWN]
+            if standPat + gain + DELTA_MARGIN <= alpha:
+                continue
+            attacker = ordering.pieceAt(bb, bitboard.moveFrom(move))[1]
+            captures.append((ordering.MVV_LVA[victim][attacker] if victim else gain, move))
+        captures.sort(reverse=True)
+
+        safety = None
+        for _, move in captures:
+            if ordering.see(board, move) < 0:
+                continue
+            if safety is None:
+                safety = bitboard.KingSafety(bb, color, board.attackMap)
+            if not bitboard.isLegalMove(bb, safety, move, color):
+                continue
+            board.push(move)
+            score = -self.quiesce(board, -beta, -alpha, ply + 1)
+            board.pop()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def quiesceEvasions(self, board, alpha, beta, ply):
+        # in check there is no standing pat, every legal reply is tried
+        if self.orderer is not None:
+            moves = board.generateMoves(None, (), self.orderer, ply)
+        else:
+            moves = bitboard.legalMoves(board, (board.moveTurn%2)+1)
+        searched = 0
+        for move in moves:
+            searched += 1
+            board.push(move)
+            score = -self.quiesce(board, -beta, -alpha, ply + 1)
+            board.pop()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        if not searched:
+            return -MATE + ply
+        return alpha
+
+    def checkLimits(self):
+        if self.stopped:
+            raise SearchStopped()
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchStopped()
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchStopped()
+
+def packBoard(board):
+    # compact, picklable position for worker processes (positions.POSITION_DTYPE bytes)
+    return positions.encodeBoards([board]).tobytes()
+
+def unpackBoard(packed):
+    return positions.decodeBoard(np.frombuffer(packed, dtype=positions.POSITION_DTYPE)[0], backend='bitboard')
+
+#a worker process's transposition table and its size in MB, kept between jobs once one asks for it
+_workerTable = (None, 0)
+
+def workerEngine(options):
+    # Engine for a worker process built from the parent's options, where 'hash' is a table size in MB
+    global _workerTable
+    options = dict(options)
+    megabytes = options.pop('hash', 0)
+    table = None
+    if megabytes:
+        if _workerTable[1] != megabytes:
+            _workerTable = (TranspositionTable(megabytes), megabytes)
+        table = _workerTable[0]
+    return Engine(table=table, **options)
+
+def searchRootMoves(packed, repetitions, options, moves, depth, pv, deadline):
+    # Worker side of ParallelEngine: search a share of the root moves. deadline is in time.time() seconds.
+    # packed carries the halfmove clock and repetitions the game's position counts, so draws by the
+    # fifty-move rule or repetition are seen as in the parent
+    board = unpackBoard(packed)
+    board.repetitions = dict(repetitions)
+    engine = workerEngine(options)
+    if deadline is not None:
+        engine.deadline = time.perf_counter() + (deadline - time.time())
+    try:
+        result = engine.searchRoot(board, list(moves), depth, pv if pv and pv[0] in moves else [])
+    except SearchStopped:
+        result = None
+    return result, engine.nodes, engine.qnodes
+
+class ParallelEngine:
+    # Root move splitting over a process pool. Every iteration deals the root moves out round-robin,
+    # searches each share with its own alpha-beta window and merges the answers in root move order,
+    # so the chosen move and score do not depend on the worker count or on which worker finishes first.
+    # Workers build their Engine from the same options as Engine (ordering, quiescence, evasions,
+    # evaluate) plus hashMegabytes, a table each worker process keeps for itself.
+    def __init__(self, workers = None, book = None, evaluate = evaluate, ordering = True, quiescence = True,
+                 evasions = False, hashMegabytes = 0):
+        self.workers = workers or os.cpu_count()
+        self.book = book
+        self.options = {'evaluate': evaluate, 'ordering': ordering, 'quiescence': quiescence, 'evasions': evasions,
+                        'hash': hashMegabytes}
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        self.nodes = 0
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    def search(self, board, maxDepth = 64, timeLimit = None, callback = None):
+        start = time.perf_counter()
+        deadline = time.time() + timeLimit if timeLimit is not None else None
+        self.nodes = 0
+        self.qnodes = 0
+        packed = packBoard(board)
+        repetitions = dict(board.repetitions)
+        rootMoves = bitboard.legalMoves(board, (board.moveTurn%2)+1)
+        if not rootMoves:
+            score = -MATE if board.inCheck() else 0
+            return SearchResult(None, score, [], 0, 0, 0.0)
+        if self.book is not None:
+            move = self.book.choose(board)
+            if move is not None:
+                return SearchResult(move, 0, [move], 0, 0, time.perf_counter() - start)
+
+        best = SearchResult(rootMoves[0], 0, [rootMoves[0]], 0, 0, 0.0)
+        pv = []
+        for depth in range(1, maxDepth + 1):
+            if pv:
+                rootMoves.remove(pv[0])
+                rootMoves.insert(0, pv[0])
+            shares = [rootMoves[worker::self.workers] for worker in range(min(self.workers, len(rootMoves)))]
+            futures = [self.pool.submit(searchRootMoves, packed, repetitions, self.options, share, depth, pv, deadline)
+                       for share in shares]
+            results = [future.result() for future in futures]
+            self.nodes += sum(nodes for _, nodes, _ in results)
+            self.qnodes += sum(qnodes for _, _, qnodes in results)
+            if any(result is None for result, _, _ in results):
+                break
+            score, pv = None, None
+            for share_score, share_pv in (result for result, _, _ in results):
+                if (score is None or share_score > score
+                        or (share_score == score and rootMoves.index(share_pv[0]) < rootMoves.index(pv[0]))):
+                    score, pv = share_score, share_pv
+            best = SearchResult(pv[0], score, pv, self.nodes, depth, time.perf_counter() - start, self.qnodes)
+            if callback:
+                callback(best)
+            if isMateScore(score) or len(rootMoves) == 1:
+                break
+            if deadline is not None and time.time() > deadline:
+                break
+        best.nodes = self.nodes
+        best.qnodes = self.qnodes
+        best.seconds = time.perf_counter() - start
+        return best
+
+def compareParallel(board, depth, workers, **options):
+    # Same fixed-depth search in one process and across workers with the same Engine options, returns
+    # both results and the speedup
+    single = Engine(**options).search(board, depth)
+    engine = ParallelEngine(workers, **options)
+    try:
+        #start the worker processes before timing
+        engine.search(board, 1)
+        parallel = engine.search(board, depth)
+    finally:
+        engine.close()
+    return single, parallel, single.seconds / parallel.seconds if parallel.seconds > 0 else 0
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Search a position for the best move.')
+    parser.add_argument('--fen', default=START_FEN)
+    parser.add_argument('--moves', nargs='*', default=[], help='moves played from --fen first (e2e4 ...), kept as game history')
+    parser.add_argument('--depth', type=int, default=64)
+    parser.add_argument('--movetime', type=float, help='seconds to search')
+    parser.add_argument('--nodes', type=int, help='node budget')
+    parser.add_argument('--book', help='opening book file (see book.py)')
+    parser.add_argument('--tablebases', help='directory of endgame tables (see tablebase.py)')
+    parser.add_argument('--hash', type=float, default=0, metavar='MB', help='transposition table size, 0 for none')
+    parser.add_argument('--hash-file', help='keep the transposition table in this file and resume from it')
+    parser.add_argument('--no-quiescence', action='store_true', help='score leaves statically, without quiescence search')
+    parser.add_argument('--evasions', action='store_true', help='let quiescence answer checks with every legal move')
+    parser.add_argument('--workers', type=int, help='split the root moves over this many processes')
+    parser.add_argument('--compare', action='store_true',
+                        help='run the same depth in one process and with --workers and report the speedup')
+    args = parser.parse_args(argv)
+    if args.movetime is None and args.nodes is None and args.depth == 64:
+        args.depth = 4
+
+    board = Board(8, 8, fenSetup(args.fen), backend='bitboard')
+    for name in args.moves:
+        found = [move for move in board.getMoveList() if bitboard.moveName(move) == name]
+        if not found:
+            parser.error('illegal move ' + name)
+        board.push(found[0])
+    openingBook = None
+    if args.book:
+        from book import Book
+        openingBook = Book(args.book)
+    def report(result):
+        print('depth %d score %d nodes %d qnodes %d nps %.0f pv %s' % (result.depth, result.score, result.nodes,
+              result.qnodes, result.nps(), ' '.join(bitboard.moveName(move) for move in result.pv)))
+    if args.compare:
+        single, parallel, speedup = compareParallel(board, args.depth, args.workers,
+                                                    quiescence=not args.no_quiescence, evasions=args.evasions)
+        for name, result in (('single', single), ('%d workers' % (args.workers or os.cpu_count()), parallel)):
+            print('%-10s %s score %d %d nodes %.3fs' % (name, bitboard.moveName(result.move), result.score, result.nodes,
+                                                        result.seconds))
+        print('speedup %.2fx' % speedup)
+        same = (single.move, single.score) == (parallel.move, parallel.score)
+        print('same move and score' if same else 'MOVE OR SCORE DIFFERS')
+        return 0 if same else 1
+    if args.workers:
+        engine = ParallelEngine(args.workers, openingBook, quiescence=not args.no_quiescence, evasions=args.evasions,
+                                hashMegabytes=args.hash)
+        try:
+            result = engine.search(board, args.depth, args.movetime, report)
+        finally:
+            engine.close()
+    else:
+        tables = None
+        if args.tablebases:
+            from tablebase import Tablebases
+            tables = Tablebases(args.tablebases)
+        table = None
+        if args.hash or args.hash_file:
+            table = TranspositionTable(args.hash or DEFAULT_HASH_MB, args.hash_file)
+        engine = Engine(book=openingBook, tablebases=tables, table=table, quiescence=not args.no_quiescence,
+                        evasions=args.evasions)
+        result = engine.search(board, args.depth, args.movetime, args.nodes, report)
+        if table is not None:
+            table.flush()
+            stats = table.stats()
+            print('hash %.1f MB %.1f%% filled, hit rate %.1f%%, replacement rate %.1f%%, collision rate %.1f%%' % (
+                  stats['megabytes'], 100*stats['filled'], 100*stats['hit_rate'], 100*stats['replacement_rate'],
+                  100*stats['collision_rate']))
+    print('bestmove %s' % (bitboard.moveName(result.move) if result.move is not None else '(none)'))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
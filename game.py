@@ -0,0 +1,97 @@
+import enum
+import logging
+
+import bitboard
+import pgn
+from chess import Board, fenSetup, toFen
+
+logger = logging.getLogger(__name__)
+
+class Outcome(enum.Enum):
+    ACCEPTED = 'accepted'
+    CHECKMATE = 'checkmate'
+    STALEMATE = 'stalemate'
+    DRAW = 'draw'
+    ILLEGAL = 'illegal'
+
+class Game:
+    # Board without the console: moves go in as encoded ints, coordinate strings (e2e4, e7e8q) or SAN,
+    # every call returns an Outcome and messages go to log, a callable or a logging.Logger.
+    def __init__(self, fen = None, backend = 'bitboard', log = None):
+        if log is None:
+            log = logger.debug
+        elif isinstance(log, logging.Logger):
+            log = log.info
+        self.log = log
+        self.board = Board(8, 8, fenSetup(fen) if fen else None, backend=backend, log=log)
+        self.moves = []
+        self.update()
+
+    def update(self):
+        # legal moves and status of the position now on the board
+        self.legalMoves = self.board.getMoveList()
+        self.status = Outcome.ACCEPTED
+        if not self.legalMoves:
+            self.status = Outcome.CHECKMATE if self.board.inCheck() else Outcome.STALEMATE
+        elif self.board.isDraw():
+            #fifty-move rule, threefold repetition or insufficient material
+            self.status = Outcome.DRAW
+
+    def sideToMove(self):
+        return (self.board.moveTurn%2)+1
+
+    def isOver(self):
+        return self.status != Outcome.ACCEPTED
+
+    def result(self):
+        if self.status == Outcome.CHECKMATE:
+            return '0-1' if self.sideToMove() == 1 else '1-0'
+        if self.status in (Outcome.STALEMATE, Outcome.DRAW):
+            return '1/2-1/2'
+        return '*'
+
+    def parseMove(self, move):
+        # the legal encoded move meant by move, or None
+        if isinstance(move, str):
+            for legal in self.legalMoves:
+                if bitboard.moveName(legal) == move.lower():
+                    return legal
+            try:
+                return pgn.sanToMove(self.board, move, self.legalMoves)
+            except pgn.PGNError:
+                return None
+        return move if move in self.legalMoves else None
+
+    def play(self, move):
+        if self.isOver():
+            self.log('Game over, %s' % self.status.value)
+            return Outcome.ILLEGAL
+        encoded = self.parseMove(move)
+        if encoded is None:
+            self.log('Illegal move %s' % (bitboard.moveName(move) if isinstance(move, int) else move))
+            return Outcome.ILLEGAL
+        self.board.push(encoded)
+        self.moves.append(encoded)
+        self.update()
+        self.log('Turn: %d %s' % (self.board.moveTurn, bitboard.moveName(encoded)))
+        if self.isOver():
+            self.log('Game over, %s %s' % (self.status.value, self.result()))
+        return self.status
+
+    def playSquares(self, start, end, promotion = bitboard.QUEEN):
+        # a move given as Board [i,j] locations, the way the GUI sees it
+        move = bitboard.encodeMove(bitboard.squareIndex(*start), bitboard.squareIndex(*end))
+        if move | (promotion << 12) in self.legalMoves:
+            move |= promotion << 12
+        return self.play(move)
+
+    def undo(self):
+        if not self.moves:
+            return None
+        move = self.moves.pop()
+        self.board.pop()
+        self.update()
+        return move
+
+    def fen(self):
+        return toFen(self.board)
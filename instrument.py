@@ -0,0 +1,167 @@
+import argparse
+import cProfile
+import functools
+import io
+import json
+import pstats
+import sys
+import time
+
+import bitboard
+import chess
+
+# (owner, attribute, counter of the returned value). enable() swaps each attribute for a wrapper
+# that counts calls and time; disable() puts the originals back, so nothing is paid while off.
+def _moveCount(result):
+    #move generators return a list, an array or 0 for no moves
+    return len(result) if hasattr(result, '__len__') else 0
+
+TARGETS = [
+    (chess.Board, '__init__', None),
+    (chess.Board, 'getAllMoves', _moveCount),
+    (chess.Board, 'getAllMovesBitboard', _moveCount),
+    (chess.Board, 'calculateMoves', None),
+    (chess.Board, 'removeIllegalMoves', _moveCount),
+    (chess.Board, 'checkEndGame', None),
+    (chess.Board, 'getMoveList', _moveCount),
+    (chess.Board, 'push', None),
+    (chess.Board, 'pop', None),
+    (bitboard, 'legalMoves', _moveCount),
+    (bitboard, 'pseudoMoves', _moveCount),
+    (bitboard, 'hasLegalMove', None),
+    (bitboard, 'isLegalMove', None),
+    (bitboard, 'isLegal', None),
+    (bitboard, 'KingSafety', None),
+]
+
+class Stats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+        self.seconds = {}
+        self.produced = {}
+
+    def asDict(self):
+        stages = {}
+        for name in sorted(self.calls):
+            stages[name] = {'calls': self.calls[name], 'seconds': self.seconds[name]}
+            if name in self.produced:
+                stages[name]['produced'] = self.produced[name]
+        #moves the generators kept after their legality checks, bitboard.legalMoves on one backend and
+        #Board.removeIllegalMoves on the other; the callers above them return the same moves again
+        generated = self.produced.get('bitboard.legalMoves', 0) + self.produced.get('Board.removeIllegalMoves', 0)
+        checks = self.calls.get('bitboard.isLegalMove', 0) + self.calls.get('bitboard.isLegal', 0)
+        return {
+            'stages': stages,
+            'positions': self.calls.get('Board.push', 0),
+            'moves_generated': generated,
+            'legality_checks': checks,
+            'legality_checks_per_move': checks / generated if generated else 0,
+        }
+
+    def toJson(self, path = None):
+        text = json.dumps(self.asDict(), indent=1)
+        if path:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+STATS = Stats()
+_originals = {}
+
+def _wrap(name, function, counter):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            STATS.calls[name] = STATS.calls.get(name, 0) + 1
+            STATS.seconds[name] = STATS.seconds.get(name, 0.0) + time.perf_counter() - start
+        if counter is not None:
+            STATS.produced[name] = STATS.produced.get(name, 0) + counter(result)
+        return result
+    return wrapper
+
+def enabled():
+    return bool(_originals)
+
+def enable(reset = True):
+    if reset:
+        STATS.reset()
+    if _originals:
+        return STATS
+    for owner, attribute, counter in TARGETS:
+        original = owner.__dict__[attribute]
+        _originals[owner, attribute] = original
+        name = '%s.%s' % (owner.__name__, attribute)
+        setattr(owner, attribute, _wrap(name, original, counter))
+    return STATS
+
+def disable():
+    for (owner, attribute), original in _originals.items():
+        setattr(owner, attribute, original)
+    _originals.clear()
+    return STATS
+
+class instrumented:
+    # with instrumented() as stats: ... counts only inside the block
+    def __enter__(self):
+        return enable()
+
+    def __exit__(self, *exc):
+        disable()
+        return False
+
+def profile(function, *args, path = None, sort = 'cumulative', limit = 30):
+    # run function(*args) under cProfile, write the top of the pstats table to path (or return it)
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).strip_dirs().sort_stats(sort).print_stats(limit)
+    if path:
+        with open(path, 'w') as f:
+            f.write(out.getvalue())
+    return result, out.getvalue()
+
+def playGame(path, backend = 'array'):
+    # replay the first game of a PGN file through makeMove, the GUI's path, with its messages dropped
+    import pgn
+    with open(path, encoding='utf-8', errors='replace') as lines:
+        headers, sans, result = next(pgn.readGames(lines))
+    board = chess.Board(8, 8, chess.fenSetup(headers.get('FEN', chess.START_FEN)), backend=backend, log=lambda message: None)
+    for san in sans:
+        move = pgn.sanToMove(board, san)
+        start, end = bitboard.moveFrom(move), bitboard.moveTo(move)
+        board.makeMove(board.state[start >> 3, start & 7], bitboard.squareLocation(end),
+                       bitboard.movePromotion(move) or bitboard.QUEEN)
+    return board
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Count and time the rules engine stages for a perft run or a game.')
+    parser.add_argument('--perft', type=int, metavar='DEPTH', help='run perft to this depth')
+    parser.add_argument('--fen', help='perft position, the starting position by default')
+    parser.add_argument('--game', metavar='PGN', help='replay the first game of this file through makeMove')
+    parser.add_argument('--backend', choices=['bitboard', 'array'], default='array')
+    parser.add_argument('--json', help='write the counters here')
+    parser.add_argument('--profile', help='also run under cProfile and write the summary here')
+    args = parser.parse_args(argv)
+
+    if args.game:
+        run = lambda: playGame(args.game, args.backend)
+    else:
+        import perft
+        board = perft.loadBoard(args.fen, args.backend)
+        run = lambda: perft.perft(board, args.perft or 3)
+    with instrumented() as stats:
+        run()
+    print(stats.toJson(args.json))
+    if args.profile:
+        profile(run, path=args.profile)
+        print('profile written to %s' % args.profile)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,55 @@
+import argparse
+import queue
+import sys
+import threading
 import tkinter as tk
 from chess import *
+from engine import Engine
 import numpy as np
 
 logic_board = Board(8,8)
+#milliseconds between checks for worker results
+POLL_MS = 50
+#colour the engine plays, 0 for none
+engine_color = 0
+engine_seconds = 2.0
+
+class Worker:
+    # Rule checks and engine searches run on this thread so the Tk event loop never waits on them.
+    # Results come back through a queue that ChessBoard.poll empties from root.after.
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.busy = False
+        self.engine = None
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, kind, *args):
+        self.busy = True
+        self.jobs.put((kind, args))
+
+    def cancel(self):
+        if self.engine:
+            self.engine.stop()
+
+    def run(self):
+        while True:
+            kind, args = self.jobs.get()
+            if kind == 'move':
+                piece, location, promotion = args
+                result = logic_board.makeMove(logic_board.state[piece.location[0], piece.location[1]], location, promotion)
+                #the next player's move map, ready before their first click
+                logic_board.getMoveMap((logic_board.moveTurn%2)+1)
+                self.results.put(('move', piece, location, result))
+            elif kind == 'think':
+                #the search pushes and pops moves, so it gets its own board; the FEN carries the halfmove
+                #clock and the game's position counts come along so it sees repetition draws
+                search_board = Board(8, 8, fenSetup(toFen(logic_board)), backend='bitboard')
+                search_board.repetitions = dict(logic_board.repetitions)
+                self.engine = Engine()
+                result = self.engine.search(search_board, timeLimit=engine_seconds)
+                self.results.put(('think', result, self.engine.stopped))
+                self.engine = None
 
 class moveDot:
     def __init__(self, canvas, image, x=0, y=0):
@@ -31,10 +78,10 @@ class DraggablePiece:
 
     def click(self, event):
         board.hideDots()
-        if self.color == 1:
-            moves = logic_board.whiteMoves.get(logic_board.state[self.location[0],self.location[1]].name)
-        elif self.color == 2:
-            moves = logic_board.blackMoves.get(logic_board.state[self.location[0],self.location[1]].name)
+        #only the side to move has a current move map, and the worker may be changing it
+        if self.color != (logic_board.moveTurn%2)+1 or worker.busy:
+            return
+        moves = logic_board.getMoveMap(self.color).get(logic_board.state[self.location[0],self.location[1]].name)
         board.showDots(moves)
         
     def drag(self, event):
@@ -49,36 +96,23 @@ class DraggablePiece:
         j, i = int(x/100), int(y/100)
         if [i,j] == self.location:
             self.canvas.coords(self.id, j*100, i*100)
-            print('no move')
+        elif worker.busy or not (0 <= i < 8 and 0 <= j < 8):
+            self.canvas.coords(self.id, self.location[1]*100, self.location[0]*100)
         else:
-            result = logic_board.makeMove(logic_board.state[self.location[0],self.location[1]], [i,j])
-            if result:
-                self.canvas.coords(self.id, x, y)
-                if isinstance(board.pieces[i,j], DraggablePiece):
-                    board.pieces[i,j].hide()
-                board.pieces[self.location[0], self.location[1]] = 0
-                board.pieces[i,j] = self
-                self.location = [i,j]
-                if result == 'Rook1':
-                    board.movePiece(board.pieces[i,0], location=[i,2])
-                elif result == 'Rook2':
-                    board.movePiece(board.pieces[i,7], location=[i,4])
-                elif result == 'Queen':
-                    board.promotePawn(board.pieces[i,j])
-                elif result == 'En Passant':
-                    if self.color == 1:
-                        board.pieces[i-1,j].hide()
-                    else:
-                        board.pieces[i+1,j].hide()
-            else:
-                self.canvas.coords(self.id, self.location[1]*100, self.location[0]*100)
-            board.hideDots()
+            #the rule check runs on the worker, ChessBoard.poll finishes or undoes the drop
+            self.canvas.coords(self.id, x, y)
+            worker.submit('move', self, [i,j], bitboard.QUEEN)
+        board.hideDots()
 
 class ChessBoard:
     def __init__(self, master):
         self.master = master
         self.canvas = tk.Canvas(self.master, width=800, height=800)
         self.canvas.pack()
+        self.status = tk.Label(self.master, anchor='w')
+        self.status.pack(fill='x')
+        self.thinking = False
+        self.master.bind('<Escape>', lambda event: worker.cancel())
         self.pieces = np.full((8,8), 0, dtype=object)
         self.dots = np.full((8,8), 0, dtype=object)
         self.displayedDots = []
@@ -117,14 +151,69 @@ class ChessBoard:
         self.pieces[i, j] = piece
         piece.location = [i,j]
         
-    def promotePawn(self, pawn):
+    def applyMove(self, piece, location, result):
+        i, j = location
+        self.movePiece(piece, location)
+        if result == 'Rook1':
+            self.movePiece(self.pieces[i,0], location=[i,2])
+        elif result == 'Rook2':
+            self.movePiece(self.pieces[i,7], location=[i,4])
+        elif result in ('Queen', 'Rook', 'Bishop', 'Knight'):
+            self.promotePawn(self.pieces[i,j], result)
+        elif result == 'En Passant':
+            if piece.color == 1:
+                self.pieces[i-1,j].hide()
+            else:
+                self.pieces[i+1,j].hide()
+
+    def poll(self):
+        while True:
+            try:
+                kind, *payload = worker.results.get_nowait()
+            except queue.Empty:
+                break
+            worker.busy = False
+            if kind == 'move':
+                piece, location, result = payload
+                if result:
+                    self.applyMove(piece, location, result)
+                    self.startEngine()
+                else:
+                    self.canvas.coords(piece.id, piece.location[1]*100, piece.location[0]*100)
+            elif kind == 'think':
+                result, cancelled = payload
+                self.thinking = False
+                if cancelled or result.move is None:
+                    self.status.config(text='Engine stopped, move for it' if cancelled else 'Game over')
+                    continue
+                self.status.config(text='Engine played %s (depth %d, %d nodes)' % (
+                    bitboard.moveName(result.move), result.depth, result.nodes))
+                start, end = bitboard.moveFrom(result.move), bitboard.moveTo(result.move)
+                piece = self.pieces[start >> 3, start & 7]
+                self.canvas.coords(piece.id, (end & 7)*100, (end >> 3)*100)
+                worker.submit('move', piece, [end >> 3, end & 7], bitboard.movePromotion(result.move) or bitboard.QUEEN)
+        self.master.after(POLL_MS, self.poll)
+
+    def startEngine(self):
+        if engine_color and (logic_board.moveTurn%2)+1 == engine_color:
+            self.thinking = True
+            worker.submit('think')
+            self.showThinking(0)
+
+    def showThinking(self, step):
+        # status line animation while the engine searches, Escape stops it
+        if self.thinking:
+            self.status.config(text='Thinking' + '.'*(step%4) + '  (Esc to stop)')
+            self.master.after(300, self.showThinking, step + 1)
+
+    def promotePawn(self, pawn, name = 'Queen'):
         i,j = pawn.location[0], pawn.location[1]
         board.pieces[i,j].hide()
-        board.createQueen(i, j, pawn.color)
+        board.createPiece(i, j, pawn.color, name)
     
-    def createQueen(self, i, j, color):
-        image = self.white_queen if color == 1 else self.black_queen
-        self.pieces[i,j] = DraggablePiece(self.canvas, 1, image, [i,j], j * 100, i * 100)
+    def createPiece(self, i, j, color, name = 'Queen'):
+        image = getattr(self, ('white_' if color == 1 else 'black_') + name.lower())
+        self.pieces[i,j] = DraggablePiece(self.canvas, color, image, [i,j], j * 100, i * 100)
         
 
     def add_pieces(self):
@@ -173,6 +262,23 @@ class ChessBoard:
                     self.pieces[0,i] = DraggablePiece(self.canvas, 1, self.white_rook, [0,i], i * 100, 0)
                     self.pieces[7,i] = DraggablePiece(self.canvas, 2, self.black_rook, [7,i], i * 100, 700)
 
-root = tk.Tk()
-board = ChessBoard(root)
-root.mainloop()
+def main(argv = None):
+    global board, worker, engine_color, engine_seconds
+    parser = argparse.ArgumentParser(description='Play chess on a tkinter board.')
+    parser.add_argument('--engine', choices=['white', 'black', 'none'], default='none', help='side the engine plays')
+    parser.add_argument('--movetime', type=float, default=engine_seconds, help='engine seconds per move')
+    args = parser.parse_args(argv)
+    engine_color = {'white': 1, 'black': 2, 'none': 0}[args.engine]
+    engine_seconds = args.movetime
+
+    worker = Worker()
+    root = tk.Tk()
+    board = ChessBoard(root)
+    board.poll()
+    board.startEngine()
+    root.mainloop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
+
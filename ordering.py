@@ -0,0 +1,166 @@
+import argparse
+import sys
+import time
+
+import bitboard
+from bitboard import PAWN, ROOK, BISHOP, KNIGHT, QUEEN, KING
+from evaluation import PIECE_VALUES
+
+# exchange values, the king priced so that trading it never looks good
+SEE_VALUES = dict(PIECE_VALUES)
+SEE_VALUES[KING] = 20000
+# MVV_LVA[victim][attacker]: most valuable victim first, cheapest attacker among equals
+MVV_LVA = [[0]*7 for _ in range(7)]
+for victim in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+    for attacker in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+        MVV_LVA[victim][attacker] = 10*SEE_VALUES[victim] - SEE_VALUES[attacker]//10
+
+# score bands, winning captures > promotions > killers > quiet moves by history > losing captures
+GOOD_CAPTURE = 4000000
+PROMOTION = 3000000
+KILLER = 2000000
+BAD_CAPTURE = -2000000
+HISTORY_LIMIT = 1000000
+KILLER_SLOTS = 2
+
+def pieceAt(bb, sq):
+    # (color, num) of the piece on sq, None when empty
+    for color in (1, 2):
+        if (bb.occupied[color] >> sq) & 1:
+            for num in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+                if (bb.pieces[color][num] >> sq) & 1:
+                    return color, num
+    return None
+
+def capturedKind(board, move):
+    # Piece.num of the piece move takes, en passant included, 0 for a quiet move
+    bb = board.bitboards
+    end = bitboard.moveTo(move)
+    if (bb.occupied[0] >> end) & 1:
+        return pieceAt(bb, end)[1]
+    start = bitboard.moveFrom(move)
+    if (bb.pieces[1][PAWN] | bb.pieces[2][PAWN]) >> start & 1 and (start & 7) != (end & 7):
+        return PAWN
+    return 0
+
+def isQuiet(board, move):
+    return not capturedKind(board, move) and not bitboard.movePromotion(move)
+
+def see(board, move):
+    # Static exchange evaluation: material the side to move nets on the target square if both
+    # sides keep recapturing with their least valuable attacker and may stop whenever it suits them
+    bb = board.bitboards
+    start, end = bitboard.moveFrom(move), bitboard.moveTo(move)
+    color, num = pieceAt(bb, start)
+    occupied = bb.occupied[0] & ~(1 << start)
+    victim = capturedKind(board, move)
+    if victim and not (bb.occupied[0] >> end) & 1:
+        #en passant, the pawn taken is beside the target square
+        occupied &= ~(1 << ((start & ~7) | (end & 7)))
+    gain = [SEE_VALUES[victim] if victim else 0]
+    if bitboard.movePromotion(move):
+        num = bitboard.movePromotion(move)
+        gain[0] += SEE_VALUES[num] - SEE_VALUES[PAWN]
+    side = (color%2)+1
+    attackers = bitboard.attackersTo(bb, end, occupied)
+    while True:
+        candidates = 0
+        for next_num in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+            candidates = attackers & bb.pieces[side][next_num]
+            if candidates:
+                break
+        if not candidates:
+            break
+        if next_num == KING and attackers & bb.occupied[(side%2)+1]:
+            #the king cannot take into a defended square
+            break
+        gain.append(SEE_VALUES[num] - gain[-1])
+        if max(-gain[-2], gain[-1]) < 0:
+            #neither side gains by going on, this capture is not made
+            gain.pop()
+            break
+        occupied &= ~(candidates & -candidates)
+        attackers = bitboard.attackersTo(bb, end, occupied)
+        num, side = next_num, (side%2)+1
+    for depth in range(len(gain) - 1, 0, -1):
+        gain[depth - 1] = -max(-gain[depth - 1], gain[depth])
+    return gain[0]
+
+class MoveOrderer:
+    # Ordering state for one search: killer slots per ply and a history table per colour
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.killers = [[None]*KILLER_SLOTS for _ in range(128)]
+        # history[color][from*64 + to]
+        self.history = [None, [0]*4096, [0]*4096]
+
+    def score(self, board, move, ply, color):
+        victim = capturedKind(board, move)
+        if victim:
+            start = bitboard.moveFrom(move)
+            attacker = pieceAt(board.bitboards, start)[1]
+            value = MVV_LVA[victim][attacker]
+            #taking something at least as valuable cannot lose material
+            if SEE_VALUES[attacker] <= SEE_VALUES[victim] or see(board, move) >= 0:
+                return GOOD_CAPTURE + value
+            return BAD_CAPTURE + value
+        promotion = bitboard.movePromotion(move)
+        if promotion:
+            return PROMOTION + SEE_VALUES[promotion]
+        killers = self.killers[ply]
+        if move in killers:
+            return KILLER - killers.index(move)
+        return self.history[color][move & 4095]
+
+    def order(self, board, moves, ply, first = None):
+        # moves best first, first (the hash or pv move) ahead of everything
+        color = (board.moveTurn%2)+1
+        ordered = sorted(moves, key=lambda move: self.score(board, move, ply, color), reverse=True)
+        if first is not None and first in ordered:
+            ordered.remove(first)
+            ordered.insert(0, first)
+        return ordered
+
+    def cutoff(self, board, move, ply, depth):
+        # a quiet move caused a beta cutoff: remember it as a killer and credit its history
+        if not isQuiet(board, move):
+            return
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1:] = killers[:-1]
+            killers[0] = move
+        history = self.history[(board.moveTurn%2)+1]
+        history[move & 4095] += depth*depth
+        if history[move & 4095] > HISTORY_LIMIT:
+            for index in range(4096):
+                history[index] //= 2
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Nodes searched at a fixed depth with and without move ordering.')
+    parser.add_argument('--depth', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    import perft
+    from engine import Engine
+    total = [0, 0]
+    print('%-10s %10s %10s %8s %9s %9s' % ('position', 'plain', 'ordered', 'saved', 'plain s', 'ordered s'))
+    for name, fen, _ in perft.REFERENCE_POSITIONS:
+        results = []
+        for ordering in (False, True):
+            board = perft.loadBoard(fen)
+            start = time.perf_counter()
+            result = Engine(ordering=ordering).search(board, args.depth)
+            results.append((result, time.perf_counter() - start))
+        (plain, plain_seconds), (ordered, ordered_seconds) = results
+        total[0] += plain.nodes
+        total[1] += ordered.nodes
+        print('%-10s %10d %10d %7.1f%% %9.2f %9.2f%s' % (name, plain.nodes, ordered.nodes,
+              100*(1 - ordered.nodes/plain.nodes), plain_seconds, ordered_seconds,
+              '' if plain.score == ordered.score else '  score %d != %d' % (plain.score, ordered.score)))
+    print('%-10s %10d %10d %7.1f%%' % ('total', total[0], total[1], 100*(1 - total[1]/total[0])))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
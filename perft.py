@@ -0,0 +1,198 @@
+import argparse
+import sys
+import time
+
+import bitboard
+import zobrist
+from chess import Board, fenSetup, START_FEN
+
+# name, fen, {depth: (nodes, captures, en passant, castles, promotions, checks)}
+# Counts from the Chess Programming Wiki perft results page. None marks a count it does not list.
+REFERENCE_POSITIONS = [
+    ('start', START_FEN, {
+        1: (20, 0, 0, 0, 0, 0),
+        2: (400, 0, 0, 0, 0, 0),
+        3: (8902, 34, 0, 0, 0, 12),
+        4: (197281, 1576, 0, 0, 0, 469),
+        5: (4865609, 82719, 258, 0, 0, 27351),
+    }),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', {
+        1: (48, 8, 0, 2, 0, 0),
+        2: (2039, 351, 1, 91, 0, 3),
+        3: (97862, 17102, 45, 3162, 0, 993),
+        4: (4085603, 757163, 1929, 128013, 15172, 25523),
+    }),
+    ('position3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', {
+        1: (14, 1, 0, 0, 0, 2),
+        2: (191, 14, 0, 0, 0, 10),
+        3: (2812, 209, 2, 0, 0, 267),
+        4: (43238, 3348, 123, 0, 0, 1680),
+        5: (674624, 52051, 1165, 0, 0, 52950),
+    }),
+    ('position4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', {
+        1: (6, 0, 0, 0, 0, 0),
+        2: (264, 87, 0, 6, 48, 10),
+        3: (9467, 1021, 4, 0, 120, 38),
+        4: (422333, 131393, 0, 7795, 60032, 15492),
+    }),
+    ('position5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', {
+        1: (44, None, None, None, None, None),
+        2: (1486, None, None, None, None, None),
+        3: (62379, None, None, None, None, None),
+        4: (2103487, None, None, None, None, None),
+    }),
+    ('position6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10', {
+        1: (46, None, None, None, None, None),
+        2: (2079, None, None, None, None, None),
+        3: (89890, None, None, None, None, None),
+        4: (3894594, None, None, None, None, None),
+    }),
+]
+
+STAT_NAMES = ['nodes', 'captures', 'en_passant', 'castles', 'promotions', 'checks']
+
+def perft(board, depth):
+    if depth == 0:
+        return 1
+    moves = board.getMoveList()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        board.push(move)
+        nodes += perft(board, depth - 1)
+        board.pop()
+    return nodes
+
+def perftStats(board, depth, stats = None):
+    # node count split by the kind of move that reached each leaf
+    if stats is None:
+        stats = dict.fromkeys(STAT_NAMES, 0)
+    if depth == 0:
+        stats['nodes'] += 1
+        return stats
+    color = (board.moveTurn%2)+1
+    for move in board.getMoveList():
+        if depth == 1:
+            start, end = bitboard.moveFrom(move), bitboard.moveTo(move)
+            if bitboard.isEnPassant(board.bitboards, move, color):
+                stats['en_passant'] += 1
+                stats['captures'] += 1
+            elif (board.bitboards.occupied[0] >> end) & 1:
+                stats['captures'] += 1
+            if (board.bitboards.pieces[color][bitboard.KING] >> start) & 1 and abs((end & 7) - (start & 7)) == 2:
+                stats['castles'] += 1
+            if bitboard.movePromotion(move):
+                stats['promotions'] += 1
+        board.push(move)
+        if depth == 1 and board.inCheck():
+            stats['checks'] += 1
+        perftStats(board, depth - 1, stats)
+        board.pop()
+    return stats
+
+def divide(board, depth):
+    counts = {}
+    for move in board.getMoveList():
+        board.push(move)
+        counts[bitboard.moveName(move)] = perft(board, depth - 1)
+        board.pop()
+    return counts
+
+def checkHashes(board, depth):
+    # walk the tree comparing the incremental Zobrist key with a full recompute, returns the mismatches
+    errors = int(board.zobristKey != zobrist.computeKey(board))
+    if depth == 0:
+        return errors
+    for move in board.getMoveList():
+        board.push(move)
+        errors += checkHashes(board, depth - 1)
+        board.pop()
+    return errors
+
+def loadBoard(fen = None, backend = 'bitboard'):
+    return Board(8, 8, fenSetup(fen or START_FEN), backend=backend)
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def printRow(depth, stats, seconds):
+    nps = stats['nodes'] / seconds if seconds > 0 else 0
+    print('%5d ' % depth + ' '.join('%12d' % stats[name] for name in STAT_NAMES)
+          + ' %9.3f %10.0f' % (seconds, nps))
+
+def printHeader():
+    print('depth ' + ' '.join('%12s' % name for name in STAT_NAMES) + ' %9s %10s' % ('seconds', 'nodes/sec'))
+
+def runSuite(maxDepth, backend, detailed):
+    failures = 0
+    total_nodes, total_seconds = 0, 0.0
+    for name, fen, expected in REFERENCE_POSITIONS:
+        print(name + ': ' + fen)
+        board = loadBoard(fen, backend)
+        for depth in sorted(expected):
+            if depth > maxDepth:
+                break
+            if detailed:
+                stats, seconds = timed(perftStats, board, depth)
+            else:
+                nodes, seconds = timed(perft, board, depth)
+                stats = dict.fromkeys(STAT_NAMES, 0)
+                stats['nodes'] = nodes
+            total_nodes += stats['nodes']
+            total_seconds += seconds
+            print('%5d %12d %9.3f %10.0f' % (depth, stats['nodes'], seconds, stats['nodes'] / max(seconds, 1e-9)), end='')
+            mismatched = [stat for stat, count in zip(STAT_NAMES, expected[depth])
+                          if count is not None and (stat == 'nodes' or detailed) and stats[stat] != count]
+            if mismatched:
+                failures += 1
+                print('  FAIL ' + ', '.join('%s %d != %d' % (stat, stats[stat], expected[depth][STAT_NAMES.index(stat)])
+                                             for stat in mismatched))
+            else:
+                print('  ok')
+    print('total %d nodes in %.3fs, %.0f nodes/sec' % (total_nodes, total_seconds, total_nodes / max(total_seconds, 1e-9)))
+    return failures
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Count move paths from a position to check Board move generation.')
+    parser.add_argument('depth', type=int, nargs='?', default=4)
+    parser.add_argument('--fen', help='position to search, the starting position by default')
+    parser.add_argument('--position', choices=[name for name, _, _ in REFERENCE_POSITIONS],
+                        help='one of the reference positions')
+    parser.add_argument('--backend', choices=['bitboard', 'array'], default='bitboard')
+    parser.add_argument('--divide', action='store_true', help='node count below each root move')
+    parser.add_argument('--suite', action='store_true',
+                        help='run every reference position up to depth and compare with the expected counts')
+    parser.add_argument('--check-hash', action='store_true',
+                        help='verify the incremental Zobrist key against a full recompute at every node')
+    parser.add_argument('--detailed', action='store_true', help='in --suite mode also compare the split counts')
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 1 if runSuite(args.depth, args.backend, args.detailed) else 0
+
+    fen = args.fen
+    if args.position:
+        fen = [fen for name, fen, _ in REFERENCE_POSITIONS if name == args.position][0]
+    board = loadBoard(fen, args.backend)
+    if args.check_hash:
+        errors, seconds = timed(checkHashes, board, args.depth)
+        print('hash mismatches %d, %.3fs' % (errors, seconds))
+        return 1 if errors else 0
+    if args.divide:
+        counts, seconds = timed(divide, board, args.depth)
+        for move in sorted(counts):
+            print('%s: %d' % (move, counts[move]))
+        print('moves %d, nodes %d, %.3fs' % (len(counts), sum(counts.values()), seconds))
+        return 0
+
+    printHeader()
+    for depth in range(1, args.depth + 1):
+        stats, seconds = timed(perftStats, board, depth)
+        printRow(depth, stats, seconds)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+import argparse
+import concurrent.futures
+import re
+import sys
+import time
+
+import bitboard
+from chess import Board, fenSetup, START_FEN
+
+PIECE_LETTERS = {'N': bitboard.KNIGHT, 'B': bitboard.BISHOP, 'R': bitboard.ROOK, 'Q': bitboard.QUEEN, 'K': bitboard.KING}
+LETTERS = {num: letter for letter, num in PIECE_LETTERS.items()}
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+TOKEN = re.compile(r'\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|1-0|0-1|1/2-1/2|\*|\d+\.+|[^\s(){};.]+[^\s(){};]*')
+SAN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+
+class PGNError(Exception):
+    def __init__(self, message, ply = None, san = None):
+        super().__init__(message if san is None else '%s at ply %d: %s' % (message, ply, san))
+        self.ply = ply
+        self.san = san
+
+def readGames(lines):
+    # Streams (headers, sans, result) out of PGN text given as an iterable of lines, e.g. an open file.
+    # Comments, NAGs and variations are dropped; only one game's movetext is held at a time.
+    headers, movetext, comment = {}, [], False
+    for line in lines:
+        if not comment and line.startswith('['):
+            if movetext:
+                yield parseMovetext(headers, movetext)
+                headers, movetext = {}, []
+            match = TAG.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"')
+            continue
+        if line.startswith('%') or not line.strip():
+            #a blank line is no movetext, so one between tag lines does not end the game
+            continue
+        movetext.append(line)
+        #a brace comment can run over several lines, tags inside it are not tags
+        if '{' in line or '}' in line:
+            comment = line.rfind('{') > line.rfind('}')
+    if movetext or headers:
+        game = parseMovetext(headers, movetext)
+        if game[1] or headers:
+            yield game
+
+def parseMovetext(headers, movetext):
+    sans, result, depth = [], headers.get('Result', '*'), 0
+    for token in TOKEN.findall('\n'.join(movetext)):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth or token[0] in '{;$' or token[0].isdigit() and token.endswith('.'):
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            sans.append(token)
+    return headers, sans, result
+
+def sanToMove(board, san, moves = None):
+    # the legal move a SAN string names, PGNError when it names none or more than one
+    if moves is None:
+        moves = board.getMoveList()
+    color = (board.moveTurn%2)+1
+    kings = board.bitboards.pieces[color][bitboard.KING]
+    text = san.rstrip('+#!?').replace('0', 'O')
+    if text in ('O-O', 'O-O-O'):
+        #kingside castling takes the king to column 1, queenside to column 5
+        column = 1 if text == 'O-O' else 5
+        found = [move for move in moves if (kings >> bitboard.moveFrom(move)) & 1
+                 and abs(bitboard.moveTo(move) - bitboard.moveFrom(move)) == 2 and bitboard.moveTo(move) & 7 == column]
+    else:
+        match = SAN.match(text)
+        if not match:
+            raise PGNError('Unreadable move', len(board.history), san)
+        letter, file, rank, target, promotion = match.groups()
+        num = PIECE_LETTERS[letter] if letter else bitboard.PAWN
+        pieces = board.bitboards.pieces[color][num]
+        end = bitboard.squareIndex(int(target[1]) - 1, bitboard.FILES.index(target[0]))
+        promotion = PIECE_LETTERS[promotion] if promotion else 0
+        found = [move for move in moves if bitboard.moveTo(move) == end and (pieces >> bitboard.moveFrom(move)) & 1
+                 and bitboard.movePromotion(move) == promotion
+                 and (file is None or bitboard.moveFrom(move) & 7 == bitboard.FILES.index(file))
+                 and (rank is None or bitboard.moveFrom(move) >> 3 == int(rank) - 1)]
+    if len(found) != 1:
+        raise PGNError('Illegal move' if not found else 'Ambiguous move', len(board.history), san)
+    return found[0]
+
+def moveToSan(board, move, moves = None):
+    if moves is None:
+        moves = board.getMoveList()
+    start, end = bitboard.moveFrom(move), bitboard.moveTo(move)
+    num = int(board.square[start >> 3, start & 7])
+    if num == bitboard.KING and abs(end - start) == 2:
+        san = 'O-O' if end & 7 == 1 else 'O-O-O'
+    else:
+        capture = board.square[end >> 3, end & 7] != -1 or (num == bitboard.PAWN and (start & 7) != (end & 7))
+        san = bitboard.squareName(end)
+        if capture:
+            san = 'x' + san
+        if num == bitboard.PAWN:
+            if capture:
+                san = bitboard.FILES[start & 7] + san
+            if bitboard.movePromotion(move):
+                san += '=' + LETTERS[bitboard.movePromotion(move)]
+        else:
+            others = [other for other in moves if bitboard.moveTo(other) == end and bitboard.moveFrom(other) != start
+                      and board.square[bitboard.moveFrom(other) >> 3, bitboard.moveFrom(other) & 7] == num]
+            prefix = ''
+            if others:
+                if all(bitboard.moveFrom(other) & 7 != start & 7 for other in others):
+                    prefix = bitboard.FILES[start & 7]
+                elif all(bitboard.moveFrom(other) >> 3 != start >> 3 for other in others):
+                    prefix = str((start >> 3) + 1)
+                else:
+                    prefix = bitboard.squareName(start)
+            san = LETTERS[num] + prefix + san
+    board.push(move)
+    if board.inCheck():
+        san += '#' if not board.getMoveList() else '+'
+    board.pop()
+    return san
+
+def startBoard(headers, backend = 'bitboard'):
+    return Board(8, 8, fenSetup(headers.get('FEN', START_FEN)), backend=backend)
+
+def replayGame(headers, sans, backend = 'bitboard'):
+    # yields (board, move) after each move is played, PGNError on the first move that does not resolve
+    board = startBoard(headers, backend)
+    for san in sans:
+        move = sanToMove(board, san)
+        board.push(move)
+        yield board, move
+
+def replayGames(lines, backend = 'bitboard'):
+    # one (headers, plies, result, error) per game, error is None or the PGNError that ended the replay
+    for headers, sans, result in readGames(lines):
+        plies, error = 0, None
+        try:
+            for _ in replayGame(headers, sans, backend):
+                plies += 1
+        except PGNError as e:
+            error = e
+        yield headers, plies, result, error
+
+def replayFile(path, backend = 'bitboard'):
+    # games, moves and the errors as (game number, message), for one file
+    games, moves, errors = 0, 0, []
+    with open(path, encoding='utf-8', errors='replace') as lines:
+        for headers, plies, result, error in replayGames(lines, backend):
+            games += 1
+            moves += plies
+            if error:
+                errors.append((games, str(error)))
+    return path, games, moves, errors
+
+def replayFiles(paths, workers = 1, backend = 'bitboard'):
+    # replayFile over several files, in a process pool when workers > 1
+    if workers > 1 and len(paths) > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            yield from pool.map(replayFile, paths, [backend]*len(paths))
+    else:
+        for path in paths:
+            yield replayFile(path, backend)
+
+def writeGame(out, moves, headers = None, result = '*', fen = None):
+    # PGN for encoded moves played from fen (the start position by default)
+    headers = dict(headers or {})
+    headers.setdefault('Result', result)
+    board = Board(8, 8, fenSetup(fen or START_FEN), backend='bitboard')
+    if fen:
+        headers.update(SetUp='1', FEN=fen)
+    for tag, value in headers.items():
+        out.write('[%s "%s"]\n' % (tag, str(value).replace('"', '\\"')))
+    words = []
+    for move in moves:
+        if board.moveTurn%2 == 0 or not words:
+            words.append('%d.%s' % (board.moveTurn//2 + 1, '' if board.moveTurn%2 == 0 else '..'))
+        words.append(moveToSan(board, move))
+        board.push(move)
+    words.append(result)
+    line = ''
+    out.write('\n')
+    for word in words:
+        if line and len(line) + len(word) >= 80:
+            out.write(line + '\n')
+            line = ''
+        line += (' ' if line else '') + word
+    out.write(line + '\n\n')
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Replay PGN files through Board and report illegal moves.')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--workers', type=int, default=1, help='replay files in this many processes')
+    parser.add_argument('--backend', choices=['bitboard', 'array'], default='bitboard')
+    parser.add_argument('--quiet', action='store_true', help='only print the totals')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    total_games, total_moves, total_errors = 0, 0, 0
+    for path, games, moves, errors in replayFiles(args.paths, args.workers, args.backend):
+        total_games += games
+        total_moves += moves
+        total_errors += len(errors)
+        if not args.quiet:
+            for game, message in errors:
+                print('%s game %d: %s' % (path, game, message))
+    seconds = time.perf_counter() - start
+    print('%d games, %d moves, %d errors in %.3fs: %.1f games/sec, %.0f moves/sec' % (
+        total_games, total_moves, total_errors, seconds, total_games / max(seconds, 1e-9), total_moves / max(seconds, 1e-9)))
+    return 1 if total_errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import batch
+from chess import Board, arraySetup
+
+# Packed positions, 35 bytes each:
+#   board     32 bytes  one nibble per square, square i*8 + j in the low nibble of byte sq//2 when sq is even
+#   ply       uint16    Board.moveTurn, which also gives the side to move and the fullmove number
+#   halfmove  uint8     Board.halfmoveClock, capped at 255 (100 already draws)
+# Nibble codes: 0 empty, Piece.num for white, Piece.num + 6 for black, and two codes that fold
+# the rest of the position into the squares:
+#   13  a pawn that can be taken en passant (white on row 3, black on row 4)
+#   14  a rook that can still castle (its corner gives the colour and side)
+POSITION_DTYPE = np.dtype([('board', np.uint8, (32,)), ('ply', '<u2'), ('halfmove', 'u1')])
+EN_PASSANT_PAWN = 13
+CASTLING_ROOK = 14
+#castling right bit -> rook square, in Board.castlingRights order KQkq
+CASTLING_ROOKS = [0, 7, 56, 63]
+
+def encodePositions(squares, colors, side, castling, enPassant, ply = None, halfmove = None):
+    # batch.py arrays -> POSITION_DTYPE records
+    squares = np.asarray(squares).reshape(-1, 64)
+    colors = np.asarray(colors).reshape(-1, 64)
+    n = len(squares)
+    side = np.asarray(side)
+    enPassant = np.asarray(enPassant)
+    castling = np.asarray(castling)
+    codes = np.where(squares == -1, 0, squares + 6*(colors == 2)).astype(np.uint8)
+    rows = np.flatnonzero(enPassant >= 0)
+    #the pawn stands one row past the square it skipped
+    codes[rows, enPassant[rows] + np.where(side[rows] == 1, -8, 8)] = EN_PASSANT_PAWN
+    for bit, sq in enumerate(CASTLING_ROOKS):
+        codes[(castling & (1 << bit)) != 0, sq] = CASTLING_ROOK
+    records = np.zeros(n, dtype=POSITION_DTYPE)
+    records['board'] = codes[:, 0::2] | (codes[:, 1::2] << 4)
+    records['ply'] = side - 1 if ply is None else ply
+    if halfmove is not None:
+        records['halfmove'] = np.minimum(halfmove, 255)
+    return records
+
+def decodePositions(records):
+    # POSITION_DTYPE records -> batch.py arrays plus the ply and halfmove clock
+    board = records['board']
+    codes = np.empty((len(records), 64), dtype=np.int8)
+    codes[:, 0::2] = board & 15
+    codes[:, 1::2] = board >> 4
+    ply = records['ply'].astype(np.int64)
+    side = (ply%2 + 1).astype(np.int8)
+
+    castling = np.zeros(len(records), dtype=np.int8)
+    for bit, sq in enumerate(CASTLING_ROOKS):
+        rights = codes[:, sq] == CASTLING_ROOK
+        castling[rights] |= 1 << bit
+        codes[rights, sq] = batch.ROOK if sq < 8 else batch.ROOK + 6
+
+    enPassant = np.full(len(records), -1, dtype=np.int8)
+    rows, pawns = np.nonzero(codes == EN_PASSANT_PAWN)
+    white = pawns >> 3 == 3
+    enPassant[rows] = np.where(white, pawns - 8, pawns + 8)
+    codes[rows, pawns] = np.where(white, batch.PAWN, batch.PAWN + 6)
+
+    colors = np.where(codes == 0, 0, np.where(codes > 6, 2, 1)).astype(np.int8)
+    squares = np.where(codes == 0, -1, codes - 6*(codes > 6)).astype(np.int8)
+    return squares.reshape(-1, 8, 8), colors.reshape(-1, 8, 8), side, castling, enPassant, ply, records['halfmove'].astype(np.int64)
+
+def encodeBoards(boards):
+    arrays = batch.stackBoards(boards)
+    return encodePositions(*arrays, ply=np.array([board.moveTurn for board in boards]),
+                           halfmove=np.array([board.halfmoveClock for board in boards]))
+
+def decodeBoard(record, backend = 'array'):
+    squares, colors, side, castling, enPassant, ply, halfmove = decodePositions(np.asarray(record, dtype=POSITION_DTYPE).reshape(1))
+    board = Board(8, 8, arraySetup(squares[0], colors[0], ply[0], castling[0], enPassant[0]), backend=backend)
+    board.halfmoveClock = int(halfmove[0])
+    return board
+
+def savePositions(path, records):
+    np.asarray(records, dtype=POSITION_DTYPE).tofile(path)
+
+def loadPositions(path, mode = 'r'):
+    # memory mapped, nothing is read until the records are touched
+    return np.memmap(path, dtype=POSITION_DTYPE, mode=mode)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Round trip random positions through the packed format.')
+    parser.add_argument('--positions', type=int, default=2000)
+    parser.add_argument('--plies', type=int, default=60, help='random plies played from the start per position')
+    parser.add_argument('--repeat', type=int, default=500, help='copies of the sample encoded and decoded in bulk')
+    args = parser.parse_args(argv)
+
+    boards = batch.randomBoards(args.positions, args.plies)
+    arrays = batch.stackBoards(boards)
+    records = encodeBoards(boards)
+    decoded = decodePositions(records)
+    mismatched = sum(not np.array_equal(original, copy) for original, copy in zip(arrays, decoded))
+    #the key leaves out en passant squares no pawn can use, which the format does not store either
+    state = lambda board: (board.zobristKey, board.halfmoveClock, board.moveTurn)
+    mismatched += sum(state(decodeBoard(record)) != state(board) for record, board in zip(records, boards))
+    print('round trip %s, %d bytes per position' % ('ok' if not mismatched else 'FAILED', POSITION_DTYPE.itemsize))
+
+    arrays = [np.tile(array, (args.repeat,) + (1,)*(array.ndim - 1)) for array in arrays]
+    start = time.perf_counter()
+    records = encodePositions(*arrays)
+    encode = time.perf_counter() - start
+    start = time.perf_counter()
+    decodePositions(records)
+    decode = time.perf_counter() - start
+    print('%d positions: encode %.0f positions/sec, decode %.0f positions/sec' % (len(records), len(records) / encode,
+                                                                                len(records) / decode))
+    return 1 if mismatched else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+import batch
+import positions
+from chess import Board
+from engine import Engine
+
+# One record per ply: the position before the move, the move played (bitboard.encodeMove) and the
+# game result from white's side, 1 win, 0 draw, -1 loss
+RECORD_DTYPE = np.dtype([('position', positions.POSITION_DTYPE), ('move', '<u2'), ('result', 'i1')])
+INDEX_NAME = 'index.json'
+
+def shardName(number):
+    return 'shard_%05d.bin' % number
+
+def playGame(rng, maxPlies = 200, randomPlies = 8, depth = 0):
+    # One game from the start position: randomPlies random moves, then depth-limited search
+    # (or random moves again when depth is 0). Returns the per-ply board arrays, moves and result.
+    board = Board(8, 8, backend='bitboard')
+    engine = Engine() if depth else None
+    arrays, moves = [], []
+    result = 0
+    while len(moves) < maxPlies:
+        legal = board.getMoveList()
+        if not legal:
+            if board.inCheck():
+                result = -1 if board.moveTurn%2 == 0 else 1
+            break
+        if board.isDraw():
+            break
+        if engine is None or len(moves) < randomPlies:
+            move = rng.choice(legal)
+        else:
+            move = engine.search(board, depth).move
+        arrays.append(batch.boardArrays(board) + (board.moveTurn, board.halfmoveClock))
+        moves.append(move)
+        board.push(move)
+    return arrays, moves, result
+
+def gameRecords(arrays, moves, result):
+    columns = list(zip(*arrays))
+    records = np.zeros(len(moves), dtype=RECORD_DTYPE)
+    records['position'] = positions.encodePositions(np.stack(columns[0]), np.stack(columns[1]), np.array(columns[2]),
+                                                    np.array(columns[3]), np.array(columns[4]), np.array(columns[5]),
+                                                    np.array(columns[6]))
+    records['move'] = moves
+    records['result'] = result
+    return records
+
+def writeShard(directory, number, size, seed, maxPlies, randomPlies, depth):
+    # Fill one shard with whole games and return (number, records, games). Written under a temporary
+    # name and renamed when complete, so an interrupted shard never looks finished. Shards are played
+    # independently from their own seeds, so the game that no longer fits is dropped rather than
+    # carried over, which leaves the end of the shard unused; size should be many games long.
+    rng = random.Random(seed)
+    path = os.path.join(directory, shardName(number))
+    shard = np.memmap(path + '.tmp', dtype=RECORD_DTYPE, mode='w+', shape=(size,))
+    count, games = 0, 0
+    while True:
+        records = gameRecords(*playGame(rng, maxPlies, randomPlies, depth))
+        if count + len(records) > size:
+            break
+        shard[count:count + len(records)] = records
+        count += len(records)
+        games += 1
+    shard.flush()
+    del shard
+    if count == 0:
+        os.remove(path + '.tmp')
+        raise ValueError('shard size %d is smaller than a game of %d records' % (size, len(records)))
+    os.replace(path + '.tmp', path)
+    return number, count, games
+
+def readIndex(directory):
+    path = os.path.join(directory, INDEX_NAME)
+    if not os.path.exists(path):
+        return {'dtype': RECORD_DTYPE.descr, 'shards': {}}
+    with open(path) as f:
+        return json.load(f)
+
+def writeIndex(directory, index):
+    path = os.path.join(directory, INDEX_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+def generate(directory, shards, size = 1 << 16, workers = 1, seed = 0, maxPlies = 200, randomPlies = 8, depth = 0,
+             callback = None):
+    # Plays games into shards 0..shards-1, skipping the ones the index already lists. Only this
+    # process writes the index, once per finished shard, so a rerun resumes at the first missing shard.
+    os.makedirs(directory, exist_ok=True)
+    index = readIndex(directory)
+    todo = [number for number in range(shards) if shardName(number) not in index['shards']]
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(writeShard, directory, number, size, seed*1000003 + number, maxPlies, randomPlies, depth)
+                   for number in todo]
+        for future in concurrent.futures.as_completed(futures):
+            number, count, games = future.result()
+            index['shards'][shardName(number)] = {'records': count, 'games': games, 'size': size}
+            writeIndex(directory, index)
+            if callback:
+                callback(number, count, games)
+    return index
+
+def loadShards(directory):
+    # the finished shards as read-only memmaps cut to their record counts, each sized by its own file
+    index = readIndex(directory)
+    return [np.memmap(os.path.join(directory, name), dtype=RECORD_DTYPE, mode='r')[:shard['records']]
+            for name, shard in sorted(index['shards'].items())]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Generate self-play training records into memory mapped shards.')
+    parser.add_argument('directory')
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--size', type=int, default=1 << 16, help='records per shard')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-plies', type=int, default=200, help='games this long are scored as draws')
+    parser.add_argument('--random-plies', type=int, default=8, help='random opening moves before the engine plays')
+    parser.add_argument('--depth', type=int, default=0, help='engine search depth, 0 plays random moves throughout')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    totals = [0, 0]
+    def report(number, count, games):
+        totals[0] += count
+        totals[1] += games
+        seconds = time.perf_counter() - start
+        print('%s: %d records, %d games (%.0f records/sec)' % (shardName(number), count, games, totals[0] / seconds))
+    index = generate(args.directory, args.shards, args.size, args.workers, args.seed, args.max_plies,
+                     args.random_plies, args.depth, report)
+    print('%d of %d shards complete in %s' % (len(index['shards']), args.shards, args.directory))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
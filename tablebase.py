@@ -0,0 +1,217 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+import bitboard
+from bitboard import PAWN, ROOK, QUEEN, KING
+
+# Three piece endgames, king and one piece against a lone king, solved by retrograde analysis.
+# A table is one int8 per position at
+#   index = ((side*64 + strong_king)*64 + weak_king)*64 + piece
+# with side 0 when the strong side is to move, squares as on Board (i*8 + j) and the strong side
+# always white; positions with black as the strong side are probed with the board mirrored.
+# Entries are distance to mate in plies from the side to move: n > 0 wins in n plies,
+# -(n + 1) is lost in n plies (-1 is checkmated) and 0 is a draw or an impossible position.
+SIGNATURES = {'KQK': QUEEN, 'KRK': ROOK, 'KPK': PAWN}
+SIZE = 2*64*64*64
+HALF = SIZE // 2
+DIRECTIONS = {ROOK: [(1,0), (-1,0), (0,1), (0,-1)]}
+DIRECTIONS[QUEEN] = DIRECTIONS[ROOK] + [(1,1), (1,-1), (-1,1), (-1,-1)]
+
+def _stepTable(di, dj):
+    # STEPS[k][sq], the square k+1 steps from sq in direction (di, dj) or -1
+    table = np.full((7, 64), -1, dtype=np.int64)
+    for sq in range(64):
+        for k in range(7):
+            x, y = (sq >> 3) + di*(k + 1), (sq & 7) + dj*(k + 1)
+            if 0 <= x < 8 and 0 <= y < 8:
+                table[k, sq] = x*8 + y
+    return table
+
+KING_TARGETS = np.array([[target for target in range(64) if (bitboard.KING_ATTACKS[sq] >> target) & 1]
+                         + [-1]*(8 - bitboard.popCount(bitboard.KING_ATTACKS[sq])) for sq in range(64)])
+KING_ADJACENT = np.array([[(bitboard.KING_ATTACKS[a] >> b) & 1 == 1 for b in range(64)] for a in range(64)])
+
+def fileName(signature):
+    return signature + '.bin'
+
+def index(side, strong, weak, piece):
+    return ((side*64 + strong)*64 + weak)*64 + piece
+
+def _grid():
+    # strong king, weak king and piece square for every index of one side to move half
+    return np.unravel_index(np.arange(HALF), (64, 64, 64))
+
+def positionLegality(num):
+    # (legal, check) over the whole table: squares distinct, kings apart, pawns off the end rows and
+    # the side that just moved not in check; check marks the weak king attacked by the piece
+    strong, weak, piece = _grid()
+    attacks = np.array([[bitboard.pieceAttacks(num, 1, p, 1 << k) for k in range(64)] for p in range(64)],
+                       dtype=np.uint64)
+    check = ((attacks[piece, strong] >> weak.astype(np.uint64)) & np.uint64(1)).astype(bool)
+    valid = (strong != weak) & (strong != piece) & (weak != piece) & ~KING_ADJACENT[strong, weak]
+    if num == PAWN:
+        valid &= (piece >> 3 != 0) & (piece >> 3 != 7)
+    #with the strong side to move the weak king may not be in check
+    legal = np.concatenate([valid & ~check, valid])
+    return legal, np.concatenate([np.zeros(HALF, dtype=bool), check])
+
+def strongMoves(num, offsets):
+    # successor indices (HALF, moves) for the strong side to move, -1 where there is no move.
+    # Promotions point into the tables at offsets['KQK'] and offsets['KRK'] of the combined value array.
+    strong, weak, piece = _grid()
+    moves = [np.where((KING_TARGETS[strong, k] >= 0) & (KING_TARGETS[strong, k] != piece),
+                      index(1, KING_TARGETS[strong, k], weak, piece), -1) for k in range(8)]
+    if num == PAWN:
+        target = piece + 8
+        free = (target != strong) & (target != weak)
+        promoting = target >> 3 == 7
+        moves.append(np.where(free & ~promoting, index(1, strong, weak, np.minimum(target, 63)), -1))
+        for signature in ('KQK', 'KRK'):
+            moves.append(np.where(free & promoting, offsets[signature] + index(1, strong, weak, target & 63), -1))
+        double = piece + 16
+        moves.append(np.where(free & (piece >> 3 == 1) & (double != strong) & (double != weak),
+                              index(1, strong, weak, np.minimum(double, 63)), -1))
+        return np.stack(moves, axis=1)
+    for di, dj in DIRECTIONS[num]:
+        steps = _stepTable(di, dj)
+        alive = np.ones(HALF, dtype=bool)
+        for k in range(7):
+            target = steps[k, piece]
+            alive &= (target >= 0) & (target != strong) & (target != weak)
+            moves.append(np.where(alive, index(1, strong, weak, target), -1))
+    return np.stack(moves, axis=1)
+
+def weakMoves(drawSlot):
+    # successor indices (HALF, 8) for the lone king to move, taking the piece goes to drawSlot
+    strong, weak, piece = _grid()
+    moves = []
+    for k in range(8):
+        target = KING_TARGETS[weak, k]
+        capture = (target == piece) & ~KING_ADJACENT[strong, np.maximum(target, 0)]
+        moves.append(np.where(capture, drawSlot, np.where((target >= 0) & (target != piece), index(0, strong, target, piece), -1)))
+    return np.stack(moves, axis=1)
+
+def backup(values, moves, valid, check):
+    # one negamax step over successor values, see the table layout for the codes
+    successor = values[np.where(valid, moves, 0)].astype(np.int16)
+    losing = valid & (successor < 0)
+    result = np.zeros(len(moves), dtype=np.int16)
+    hasMove = valid.any(axis=1)
+    allWin = hasMove & ~(valid & (successor <= 0)).any(axis=1)
+    result = np.where(allWin, -(np.where(valid, successor, 0).max(axis=1) + 2), result)
+    result = np.where(losing.any(axis=1), np.where(losing, -successor, 1000).min(axis=1), result)
+    result = np.where(~hasMove & check, -1, result)
+    return result
+
+def generate(signature, solved = None):
+    # Retrograde analysis for one signature. solved holds the finished tables KPK promotes into.
+    num = SIGNATURES[signature]
+    legal, check = positionLegality(num)
+    parts, offsets = [np.zeros(SIZE, dtype=np.int16), np.zeros(1, dtype=np.int16)], {}
+    drawSlot = SIZE
+    combinedLegal = [legal, np.ones(1, dtype=bool)]
+    if num == PAWN:
+        for name in ('KQK', 'KRK'):
+            offsets[name] = sum(len(part) for part in parts)
+            parts.append(np.asarray(solved[name], dtype=np.int16))
+            combinedLegal.append(positionLegality(SIGNATURES[name])[0])
+    values = np.concatenate(parts)
+    combinedLegal = np.concatenate(combinedLegal)
+
+    halves = []
+    for side, moves in ((0, strongMoves(num, offsets)), (1, weakMoves(drawSlot))):
+        valid = (moves >= 0) & combinedLegal[np.maximum(moves, 0)]
+        halves.append((side*HALF, moves, valid, check[side*HALF:(side + 1)*HALF], legal[side*HALF:(side + 1)*HALF]))
+    passes = 0
+    changed = True
+    while changed:
+        changed = False
+        passes += 1
+        for first, moves, valid, side_check, side_legal in halves:
+            updated = np.where(side_legal, backup(values, moves, valid, side_check), 0)
+            if not np.array_equal(updated, values[first:first + HALF]):
+                values[first:first + HALF] = updated
+                changed = True
+    table = values[:SIZE]
+    assert table.min() >= -128 and table.max() <= 127
+    return table.astype(np.int8), passes
+
+def generateAll(directory, signatures = ('KQK', 'KRK', 'KPK'), callback = None):
+    os.makedirs(directory, exist_ok=True)
+    solved = {}
+    for signature in ('KQK', 'KRK', 'KPK'):
+        path = os.path.join(directory, fileName(signature))
+        if signature not in signatures and not (signature != 'KPK' and 'KPK' in signatures):
+            continue
+        if os.path.exists(path):
+            solved[signature] = np.memmap(path, dtype=np.int8, mode='r')
+            continue
+        start = time.perf_counter()
+        table, passes = generate(signature, solved)
+        table.tofile(path)
+        solved[signature] = table
+        if callback:
+            callback(signature, table, passes, time.perf_counter() - start)
+    return solved
+
+class Tablebases:
+    # The table files found in directory, memory mapped. probe is O(1): a material check and one lookup.
+    def __init__(self, directory):
+        self.tables = {}
+        for signature, num in SIGNATURES.items():
+            path = os.path.join(directory, fileName(signature))
+            if os.path.exists(path):
+                self.tables[num] = np.memmap(path, dtype=np.int8, mode='r')
+
+    def probe(self, board):
+        # ('win' | 'loss' | 'draw', plies) for the side to move, None when the position is not covered
+        bb = board.bitboards
+        occupied = bb.occupied[0]
+        if occupied.bit_count() != 3 or board.castlingRights:
+            return None
+        for color in (1, 2):
+            other = (color%2)+1
+            if bb.occupied[other] != bb.pieces[other][KING] or bb.occupied[color].bit_count() != 2:
+                continue
+            for num, table in self.tables.items():
+                if bb.pieces[color][num]:
+                    strong = bb.pieces[color][KING].bit_length() - 1
+                    weak = bb.pieces[other][KING].bit_length() - 1
+                    piece = bb.pieces[color][num].bit_length() - 1
+                    if color == 2:
+                        #mirror the rows so the strong side plays up the board as white
+                        strong, weak, piece = strong ^ 56, weak ^ 56, piece ^ 56
+                    side = 0 if (board.moveTurn%2)+1 == color else 1
+                    code = int(table[index(side, strong, weak, piece)])
+                    if code > 0:
+                        return 'win', code
+                    if code < 0:
+                        return 'loss', -code - 1
+                    return 'draw', 0
+        return None
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Generate or probe the three piece endgame tables.')
+    parser.add_argument('directory', nargs='?', default='tablebases')
+    parser.add_argument('--signatures', nargs='+', choices=list(SIGNATURES), default=list(SIGNATURES))
+    parser.add_argument('--fen', help='probe this position instead of generating')
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        from chess import Board, fenSetup
+        result = Tablebases(args.directory).probe(Board(8, 8, fenSetup(args.fen), backend='bitboard'))
+        print('not in the tables' if result is None else '%s in %d plies' % result)
+        return 0
+    def report(signature, table, passes, seconds):
+        wins = np.count_nonzero(table[:HALF] > 0)
+        print('%s: %d wins with the strong side to move, longest mate %d plies, %d passes, %.1fs' % (
+            signature, wins, table.max(), passes, seconds))
+    generateAll(args.directory, args.signatures, report)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
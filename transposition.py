@@ -0,0 +1,163 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+
+# One slot: zobrist key, best move (bitboard.encodeMove, 0 for none), score, searched depth, bound
+# and the search generation that last stored or found it. Bound 0 marks an empty slot.
+ENTRY_DTYPE = np.dtype([('key', '<u8'), ('move', '<u2'), ('score', '<i4'), ('depth', 'u1'), ('bound', 'u1'),
+                        ('age', 'u1')])
+EXACT, LOWER, UPPER = 1, 2, 3
+#slots per bucket, a position may sit in any slot of the bucket its key picks
+BUCKET_SIZE = 4
+#plies of depth a slot loses per search generation it has gone unused, when choosing one to replace
+AGE_WEIGHT = 2
+DEFAULT_MEGABYTES = 16
+#key of the header record that starts a table file, its score holds the current search generation
+HEADER_KEY = 0x5452414E53504F53
+
+class TranspositionTable:
+    # Fixed size table of buckets in a preallocated structured array. With a path the array is a
+    # memory mapped file: an existing file is reopened as it is (its size wins over megabytes), so a
+    # long analysis can stop and resume warm; a missing one is created at the requested size.
+    # A file starts with a header record keeping the generation, which ages wrap around and cannot give.
+    def __init__(self, megabytes = DEFAULT_MEGABYTES, path = None):
+        buckets = max(1, int(megabytes*1024*1024) // (ENTRY_DTYPE.itemsize*BUCKET_SIZE))
+        self.path = path
+        self.file = None
+        self.age = 0
+        if path is None:
+            self.entries = np.zeros((buckets, BUCKET_SIZE), dtype=ENTRY_DTYPE)
+        else:
+            if os.path.exists(path):
+                self.file = np.memmap(path, dtype=ENTRY_DTYPE, mode='r+')
+                if not len(self.file) or int(self.file[0]['key']) != HEADER_KEY:
+                    raise ValueError('%s is not a transposition table file' % path)
+                self.age = int(self.file[0]['score'])
+            else:
+                self.file = np.memmap(path, dtype=ENTRY_DTYPE, mode='w+', shape=(1 + buckets*BUCKET_SIZE,))
+                self.file[0] = (HEADER_KEY, 0, 0, 0, 0, 0)
+            self.entries = self.file[1:].reshape(-1, BUCKET_SIZE)
+        self.buckets = len(self.entries)
+        self.keys = self.entries['key']
+        self.moves = self.entries['move']
+        self.scores = self.entries['score']
+        self.depths = self.entries['depth']
+        self.bounds = self.entries['bound']
+        self.ages = self.entries['age']
+        self.resetStats()
+
+    def __len__(self):
+        return self.entries.size
+
+    def megabytes(self):
+        return self.entries.nbytes / (1024*1024)
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        #stores that evicted a different position from a full bucket
+        self.replacements = 0
+        #probes missing on a bucket full of other positions, the key lost a slot or never got one
+        self.collisions = 0
+
+    def clear(self):
+        self.entries[...] = 0
+        self.setAge(0)
+        self.resetStats()
+
+    def newSearch(self):
+        # start a search generation, entries left from earlier ones become cheaper to replace
+        self.setAge((self.age + 1) & 255)
+
+    def setAge(self, age):
+        self.age = age
+        if self.file is not None:
+            self.file[0]['score'] = age
+
+    def probe(self, key):
+        # (move, score, depth, bound) stored for key, None on a miss
+        self.probes += 1
+        index = key % self.buckets
+        row = self.keys[index].tolist()
+        if key not in row:
+            if self.bounds[index].all():
+                self.collisions += 1
+            return None
+        slot = row.index(key)
+        if not self.bounds[index, slot]:
+            return None
+        self.hits += 1
+        self.ages[index, slot] = self.age
+        return int(self.moves[index, slot]), int(self.scores[index, slot]), int(self.depths[index, slot]), int(self.bounds[index, slot])
+
+    def store(self, key, move, score, depth, bound):
+        # Same position: overwrite, keeping the old best move if this result has none. Otherwise an
+        # empty slot, else the slot worth least, depth first with AGE_WEIGHT plies off per generation unused
+        self.stores += 1
+        index = key % self.buckets
+        row = self.keys[index].tolist()
+        bounds = self.bounds[index].tolist()
+        if key in row and bounds[row.index(key)]:
+            slot = row.index(key)
+            if not move:
+                move = int(self.moves[index, slot])
+        elif 0 in bounds:
+            slot = bounds.index(0)
+        else:
+            depths, ages = self.depths[index].tolist(), self.ages[index].tolist()
+            slot = min(range(BUCKET_SIZE), key=lambda slot: depths[slot] - AGE_WEIGHT*((self.age - ages[slot]) & 255))
+            self.replacements += 1
+        self.entries[index, slot] = (key, move, score, min(depth, 255), bound, self.age)
+
+    def filled(self):
+        # fraction of slots in use, reads the whole table
+        return np.count_nonzero(self.bounds) / self.entries.size
+
+    def stats(self):
+        return {
+            'megabytes': self.megabytes(),
+            'entries': len(self),
+            'filled': float(self.filled()),
+            'probes': self.probes,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.probes if self.probes else 0,
+            'stores': self.stores,
+            'replacements': self.replacements,
+            'replacement_rate': self.replacements / self.stores if self.stores else 0,
+            'collisions': self.collisions,
+            'collision_rate': self.collisions / self.probes if self.probes else 0,
+        }
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def save(self, path):
+        # write the table to path, reopen it later with TranspositionTable(path=path)
+        if self.file is not None and self.path == path:
+            self.flush()
+            return
+        header = np.array([(HEADER_KEY, 0, self.age, 0, 0, 0)], dtype=ENTRY_DTYPE)
+        np.concatenate([header, self.entries.ravel()]).tofile(path)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Describe a saved transposition table file.')
+    parser.add_argument('path')
+    args = parser.parse_args(argv)
+
+    table = TranspositionTable(path=args.path)
+    used = table.bounds != 0
+    print('%s: %.1f MB, %d entries, %.1f%% filled, generation %d' % (args.path, table.megabytes(), len(table),
+          100*table.filled(), table.age))
+    for bound, name in ((EXACT, 'exact'), (LOWER, 'lower'), (UPPER, 'upper')):
+        print('%-6s %d' % (name, np.count_nonzero(table.bounds == bound)))
+    if used.any():
+        depths = np.bincount(table.depths[used])
+        print('depth  ' + ' '.join('%d:%d' % (depth, count) for depth, count in enumerate(depths.tolist()) if count))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
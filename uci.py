@@ -0,0 +1,149 @@
+import sys
+import threading
+
+import bitboard
+from chess import Board, fenSetup, START_FEN
+from engine import Engine, MATE, isMateScore
+from transposition import TranspositionTable, DEFAULT_MEGABYTES
+
+NAME = 'ChessAI'
+#fraction of the remaining clock spent on one move when no movestogo is given
+MOVES_LEFT = 30
+
+def scoreText(score):
+    if isMateScore(score):
+        plies = MATE - abs(score)
+        return 'mate %d' % ((plies + 1)//2 if score > 0 else -((plies + 1)//2))
+    return 'cp %d' % score
+
+def timeBudget(board, options):
+    # seconds to search for a go command, None for no limit
+    if 'movetime' in options:
+        return options['movetime'] / 1000
+    white = board.moveTurn%2 == 0
+    remaining = options.get('wtime' if white else 'btime')
+    if remaining is None:
+        return None
+    increment = options.get('winc' if white else 'binc', 0)
+    budget = remaining / options.get('movestogo', MOVES_LEFT) + increment*0.8
+    return max(min(budget, remaining/2 - 50), 10) / 1000
+
+class UCI:
+    # UCI commands in, engine output out. Searches run on their own thread so stop and isready
+    # are answered while one is going.
+    def __init__(self, out = sys.stdout):
+        self.out = out
+        self.board = Board(8, 8, fenSetup(START_FEN), backend='bitboard')
+        #one table for every search of the session, sized by the Hash option
+        self.table = TranspositionTable(DEFAULT_MEGABYTES)
+        self.engine = Engine(table=self.table)
+        self.thread = None
+        #set by stop, a go infinite search holds its bestmove until then
+        self.stopped = threading.Event()
+
+    def send(self, line):
+        self.out.write(line + '\n')
+        self.out.flush()
+
+    def handle(self, line):
+        # returns False on quit
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+        if command == 'uci':
+            self.send('id name ' + NAME)
+            self.send('id author ' + NAME + ' developers')
+            self.send('option name Hash type spin default %d min 1 max 4096' % DEFAULT_MEGABYTES)
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'setoption':
+            self.stop()
+            self.setOption(args)
+        elif command == 'ucinewgame':
+            self.stop()
+            self.board = Board(8, 8, fenSetup(START_FEN), backend='bitboard')
+            self.table.clear()
+        elif command == 'position':
+            self.stop()
+            self.position(args)
+        elif command == 'go':
+            self.stop()
+            self.go(args)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'quit':
+            self.stop()
+            return False
+        return True
+
+    def stop(self):
+        # also ends a go infinite search, which otherwise holds its thread until stop arrives
+        self.stopped.set()
+        self.engine.stop()
+        self.wait()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def setOption(self, args):
+        # setoption name <name> value <value>, Hash is the only option
+        if 'value' not in args:
+            return
+        name = ' '.join(args[1:args.index('value')]).lower()
+        value = ' '.join(args[args.index('value') + 1:])
+        if name == 'hash' and value.isdigit():
+            self.table = TranspositionTable(min(max(int(value), 1), 4096))
+
+    def position(self, args):
+        if args and args[0] == 'fen':
+            end = args.index('moves') if 'moves' in args else len(args)
+            fen, moves = ' '.join(args[1:end]), args[end + 1:]
+        else:
+            fen, moves = START_FEN, args[2:] if len(args) > 1 and args[1] == 'moves' else []
+        board = Board(8, 8, fenSetup(fen), backend='bitboard')
+        for name in moves:
+            found = [move for move in board.getMoveList() if bitboard.moveName(move) == name]
+            if not found:
+                self.send('info string illegal move ' + name)
+                break
+            board.push(found[0])
+        self.board = board
+
+    def go(self, args):
+        options = {}
+        for key, value in zip(args, args[1:] + ['']):
+            if key in ('depth', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo', 'nodes'):
+                options[key] = int(value)
+        infinite = 'infinite' in args
+        depth = options.get('depth', 64)
+        seconds = None if infinite else timeBudget(self.board, options)
+        self.engine = Engine(table=self.table)
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.search, args=(self.board, depth, seconds, options.get('nodes'), infinite),
+                                       daemon=True)
+        self.thread.start()
+
+    def search(self, board, depth, seconds, nodes, infinite = False):
+        def info(result):
+            self.send('info depth %d score %s nodes %d nps %d time %d pv %s' % (
+                result.depth, scoreText(result.score), result.nodes, result.nps(), result.seconds*1000,
+                ' '.join(bitboard.moveName(move) for move in result.pv)))
+        result = self.engine.search(board, depth, seconds, nodes, info)
+        if infinite:
+            self.stopped.wait()
+        self.send('bestmove ' + (bitboard.moveName(result.move) if result.move is not None else '0000'))
+
+def main():
+    uci = UCI()
+    for line in sys.stdin:
+        if not uci.handle(line):
+            break
+    uci.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,35 @@
+import random
+
+import numpy as np
+
+# Fixed seed so keys stay the same across runs and processes (books and tables store them)
+_random = random.Random(0x5A0B157)
+
+def _key():
+    return _random.getrandbits(64)
+
+# PIECE_KEYS[color][num][square]
+PIECE_KEYS = [[[_key() for sq in range(64)] for num in range(7)] for color in range(3)]
+SIDE_KEY = _key()
+# CASTLING_KEYS[rights] for every combination of the four castling bits on Board.castlingRights
+_rights = [_key() for bit in range(4)]
+CASTLING_KEYS = [0]*16
+for rights in range(16):
+    for bit in range(4):
+        if rights & (1 << bit):
+            CASTLING_KEYS[rights] ^= _rights[bit]
+# EN_PASSANT_KEYS[column], only hashed while some pawn can actually take en passant
+EN_PASSANT_KEYS = [_key() for j in range(8)]
+
+def computeKey(board):
+    # Full recompute from the board, used at setup and to verify the incremental key
+    key = 0
+    for sq in np.flatnonzero(board.square.ravel() != -1).tolist():
+        piece = board.state[sq >> 3, sq & 7]
+        key ^= PIECE_KEYS[piece.color][piece.num][sq]
+    if board.moveTurn%2 == 1:
+        key ^= SIDE_KEY
+    key ^= CASTLING_KEYS[board.getCastlingRights()]
+    if board.enPassantPawns:
+        key ^= EN_PASSANT_KEYS[board.enPassantSquare[1]]
+    return key